@@ -0,0 +1,43 @@
+# Walker's alias method, built with Vose's algorithm, for sampling from a fixed
+# list of integer weights in constant time.
+#
+# Everything is kept in integers: each of the n columns holds 'total' units,
+# split between the column's own index and its alias, so that a single draw
+# from [0, n * total) picks a column and a point within it, with exactly the
+# same distribution as the original weights.
+class AliasTable():
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        assert n > 0 and total > 0, f'Can\'t build an alias table for weights {weights}, they must be non-empty and have a positive total.'
+
+        scaled = [weight * n for weight in weights]
+        small = [i for i, weight in enumerate(scaled) if weight < total]
+        large = [i for i, weight in enumerate(scaled) if weight >= total]
+        prob = [total] * n
+        alias = list(range(n))
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left over fills its column exactly, so keeps the default prob of total.
+
+        self.n = n
+        self.total = total
+        self.prob = prob
+        self.alias = alias
+
+    # rng: Anything with a randrange method, such as the random module.
+    def sample(self, rng):
+        column, point = divmod(rng.randrange(self.n * self.total), self.total)
+        if point < self.prob[column]:
+            return column
+        return self.alias[column]
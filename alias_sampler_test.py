@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from alias_sampler import AliasTable
+
+class FixedRandom():
+
+    def __init__(self, value):
+        self.value = value
+
+    def randrange(self, stop):
+        assert self.value < stop
+        return self.value
+
+# Every possible draw, so counts are exact rather than statistical.
+def exact_counts(weights):
+    table = AliasTable(weights)
+    counts = [0] * len(weights)
+    for value in range(table.n * table.total):
+        counts[table.sample(FixedRandom(value))] += 1
+    return counts
+
+class AliasTableTestCase(unittest.TestCase):
+
+    def assert_exact(self, weights):
+        self.assertEqual(exact_counts(weights), [weight * len(weights) for weight in weights])
+
+    def test_single_weight(self):
+        self.assert_exact([7])
+
+    def test_uniform(self):
+        self.assert_exact([1, 1, 1, 1])
+
+    def test_skewed(self):
+        self.assert_exact([10, 5, 1])
+
+    def test_zero_weight_never_picked(self):
+        self.assert_exact([0, 3, 0, 1])
+
+    def test_random_weights(self):
+        rng = random.Random(1234)
+        for _ in range(25):
+            self.assert_exact([rng.randint(0, 50) for _ in range(rng.randint(1, 12))] + [1])
+
+    def test_rejects_zero_total(self):
+        with self.assertRaises(AssertionError):
+            AliasTable([0, 0])
+        with self.assertRaises(AssertionError):
+            AliasTable([])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+import argparse
+import gc
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import choice_generator
+import choices_validator
+import heatmap
+import import_graph
+import profiling
+from nested_choices import NestedChoices, iter_choices_tree, read_choices_file
+
+DEFAULT_TABLES = ['random_street.txt', 'custom_shops.txt', 'random_npc.txt', 'npc_events.txt', 'random_events.txt', 'test_places.txt']
+SEED = 0
+# Subtables some tables call without importing, which whoever uses them is
+# expected to register, as (namespace_id, choices, weights).
+EXTERNAL_SUBTABLES = {
+    'test_places.txt': [('countries_table', ['Germany', 'France', 'UK'], [5, 3, 1])],
+}
+
+# Loads a table from its sources, bypassing the table cache and any compiled
+# artifact, so every load does the full amount of work.
+def load_table(filename):
+    nested_choices = NestedChoices.load_from_file(filename, cache=None, prefer_compiled=False)
+    for namespace_id, choices, weights in EXTERNAL_SUBTABLES.get(filename, []):
+        nested_choices.register_subtable(NestedChoices.load_from_string_list(namespace_id, choices, weights))
+    return nested_choices
+
+def median_seconds(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+# peak_bytes: The most memory allocated at once while loading.
+# retained_bytes: The memory still held by the loaded table.
+def bench_load(filename, repeat):
+    result = {'seconds': median_seconds(lambda: load_table(filename), repeat)}
+    gc.collect()
+    tracemalloc.start()
+    nested_choices = load_table(filename)
+    result['retained_bytes'], result['peak_bytes'] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del nested_choices
+    return result
+
+# Validating a table and everything it imports, which is part of loading it.
+def bench_validation(filename, repeat):
+    graph = import_graph.build_import_graph(filename, read_choices_file)
+    def validate():
+        for node in graph.values():
+            choices_validator.validate_choices(node.namespace_id, node.choices_string)
+    return {'seconds': median_seconds(validate, repeat)}
+
+# Generates num independent results, each seeded from SEED and its index so
+# every run generates the same results, timing each one.
+def bench_generation(nested_choices, num):
+    latencies = []
+    results = nested_choices.iter_batch(num, seed=SEED)
+    start = time.perf_counter()
+    while True:
+        item_start = time.perf_counter()
+        if next(results, None) is None:
+            break
+        latencies.append(time.perf_counter() - item_start)
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'generations': num,
+        'generations_per_sec': num / elapsed,
+        'p50_ms': quantiles[49] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+    }
+
+# The same generations again, traced, which is too slow to time them by.
+# peak_bytes: The most memory allocated at once while generating.
+# allocated_blocks: How many more memory blocks are allocated after generating
+# than before, once garbage is collected. Anything but ~0 means something is
+# holding on to memory between generations.
+def bench_generation_memory(nested_choices, num):
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for _ in nested_choices.iter_batch(num, seed=SEED):
+        pass
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    return {'peak_bytes': peak_bytes, 'allocated_blocks': sys.getallocatedblocks() - blocks}
+
+# Times the replacement passes (ranges, state interpolation, subtable calls)
+# and state extraction that every expanded choice goes through, over every
+# choice in the table. Choices that call subtables are left out, since calling
+# them would time generating the subtable too.
+def bench_replacements(nested_choices, repeat):
+    generator = choice_generator.ChoiceGenerator(nested_choices, SEED)
+    texts = [wc.template.text for wc in iter_choices_tree(nested_choices.choices) if '@' not in wc.choice]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            generator.extract_state(generator.make_replacements(text, None))
+    elapsed = time.perf_counter() - start
+    return {'choices': len(texts), 'us_per_expansion': elapsed / (repeat * len(texts)) * 1e6}
+
+# Generation throughput with logging disabled altogether, as a baseline, and
+# with the root logger at each of WARNING level, as it is by default, so hot
+# path logging is off, INFO level, so only its info messages are built, and
+# DEBUG level, so all of them are. Messages are handled but thrown away.
+LOGGING_LEVELS = [('disabled', None), ('warning', logging.WARNING), ('info', logging.INFO), ('debug', logging.DEBUG)]
+
+def bench_logging(nested_choices, num):
+    root = logging.getLogger()
+    level, handlers, disabled = root.level, root.handlers, root.manager.disable
+    results = {}
+    try:
+        root.handlers = [logging.NullHandler()]
+        for name, bench_level in LOGGING_LEVELS:
+            if bench_level is None:
+                logging.disable(logging.CRITICAL)
+            else:
+                logging.disable(logging.NOTSET)
+                root.setLevel(bench_level)
+            results[name] = bench_generation(nested_choices, num)['generations_per_sec']
+    finally:
+        logging.disable(disabled)
+        root.setLevel(level)
+        root.handlers = handlers
+    return {'generations_per_sec': results}
+
+# Generates from each table with every phase timed, see profiling.PhaseProfiler.
+def profile_tables(tables, num, profiler=None):
+    with profiling.profile(profiler) as profiler:
+        for filename in tables:
+            try:
+                load_table(filename).gen_batch(num, seed=SEED)
+            except Exception as e:
+                logging.warning(f'Profiling {filename} failed: {e!r}')
+    return profiler
+
+# A table that fails to load or generate is reported with its error rather than
+# stopping the whole run.
+def bench_table(filename, num, repeat):
+    result = {'table': filename}
+    try:
+        result['load'] = bench_load(filename, repeat)
+        result['validation'] = bench_validation(filename, repeat)
+        nested_choices = load_table(filename)
+        result['generation'] = bench_generation(nested_choices, num)
+        result['generation'].update(bench_generation_memory(nested_choices, num))
+        result['replacements'] = bench_replacements(nested_choices, repeat)
+    except Exception as e:
+        logging.warning(f'Benchmarking {filename} failed: {e!r}')
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(tables, num, repeat):
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'seed': SEED,
+        'num': num,
+        'repeat': repeat,
+        'tables': [bench_table(filename, num, repeat) for filename in tables],
+    }
+
+def format_result(result):
+    if 'error' in result:
+        return f"{result['table']}: {result['error']}"
+    generation = result['generation']
+    return (f"{result['table']}: loads in {result['load']['seconds'] * 1000:.2f}ms ({result['validation']['seconds'] * 1000:.2f}ms validating), "
+            f"{generation['generations_per_sec']:.0f} generations/sec, p50 {generation['p50_ms']:.3f}ms, p99 {generation['p99_ms']:.3f}ms, "
+            f"peak {generation['peak_bytes'] / 1024:.0f}KiB, {result['replacements']['us_per_expansion']:.2f}us per expansion")
+
+# Prints how each table's throughput and p99 latency changed from a previous run.
+def compare(results, baseline):
+    baseline_tables = {result['table']: result for result in baseline['tables']}
+    print(f"Compared to {baseline.get('commit')}:")
+    for result in results['tables']:
+        old = baseline_tables.get(result['table'])
+        if old is None or 'error' in old or 'error' in result:
+            continue
+        throughput = result['generation']['generations_per_sec'] / old['generation']['generations_per_sec']
+        p99 = result['generation']['p99_ms'] / old['generation']['p99_ms']
+        print(f"{result['table']}: {throughput:.2f}x generations/sec, {p99:.2f}x p99 latency")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading and generating from choices files.')
+    parser.add_argument('tables', nargs='*', default=DEFAULT_TABLES)
+    parser.add_argument('--num', type=int, default=1000, help='How many results to generate from each table.')
+    parser.add_argument('--repeat', type=int, default=20, help='How many times to repeat loading, validating and the replacement passes.')
+    parser.add_argument('--logging', action='store_true', help='Instead, compare throughput with logging disabled and at each level.')
+    parser.add_argument('--profile', help='Instead, time each phase of generation, and write the stacks to this file in collapsed stack format, for flame graphs.')
+    parser.add_argument('--heatmap', type=int, nargs='?', const=30, help='Instead, report how often each choice was picked and how long expanding it took, for the given number of most expensive choices, and which choices were never picked.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    parser.add_argument('--output', help='Also write the results as JSON to this file.')
+    parser.add_argument('--compare', help='A file of results from a previous run to compare against.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.logging:
+        for filename in args.tables:
+            result = bench_logging(load_table(filename), args.num)
+            rates = ', '.join(f'{rate:.0f} {name}' for name, rate in result['generations_per_sec'].items())
+            print(f'{filename}: generations/sec with logging {rates}')
+        exit()
+
+    if args.profile:
+        profiler = profile_tables(args.tables, args.num)
+        with open(args.profile, 'w') as profile_file:
+            profiler.write_collapsed(profile_file)
+        print(profiler.format_report())
+        exit()
+
+    if args.heatmap is not None:
+        node_heatmap = profile_tables(args.tables, args.num, heatmap.NodeHeatmap())
+        print(node_heatmap.format_report(args.heatmap))
+        exit()
+
+    results = run(args.tables, args.num, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results['tables']:
+            print(format_result(result))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
@@ -0,0 +1,46 @@
+import logging
+import os
+import tempfile
+import unittest
+
+import bench
+
+class BenchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_bench_table(self):
+        result = bench.bench_table('random_events.txt', num=20, repeat=1)
+        self.assertEqual(result['generation']['generations'], 20)
+        self.assertLessEqual(result['generation']['p50_ms'], result['generation']['p99_ms'])
+        self.assertGreater(result['load']['peak_bytes'], 0)
+        self.assertNotIn('error', result)
+
+    def test_external_subtables(self):
+        self.assertNotIn('error', bench.bench_table('test_places.txt', num=5, repeat=1))
+
+    def test_failing_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'broken.txt')
+            with open(filename, 'w') as f:
+                # Indented too far.
+                f.write('broken\n\n1 $\n  1 a\n      1 too deep\n')
+            result = bench.bench_table(filename, num=5, repeat=1)
+        self.assertIn('improper number of spaces', result['error'])
+        self.assertNotIn('generation', result)
+
+    def test_bench_logging(self):
+        root = logging.getLogger()
+        level, handlers = root.level, root.handlers
+        result = bench.bench_logging(bench.load_table('random_events.txt'), num=5)
+        self.assertEqual(list(result['generations_per_sec']), ['disabled', 'warning', 'info', 'debug'])
+        # Logging is left as it was.
+        self.assertEqual(root.manager.disable, logging.CRITICAL)
+        self.assertEqual((root.level, root.handlers), (level, handlers))
+
+if __name__ == '__main__':
+    unittest.main()
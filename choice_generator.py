@@ -1,144 +1,477 @@
 import logging
-import random
-import re
-import math
-from collections import defaultdict
 
+import layered_state
 import state_clause_handler
-import choices_util
+import weight_tree
+import choice_template
 import subtable_calls
+import profiling
 import range_replacements
+import seeding
+import set_up_logging
 import interpolation_replacements
-from state_regexes import STATE_REGEXES
-
-class Tag():
-
-    def __init__(self, num, symbol):
-        self.num = num
-        self.symbol = symbol
-
-    def __str__(self):
-        return self.symbol
-
-    def __repr__(self):
-        return self.__str__()
+from state_regexes import PATTERNS, PATTERN_TRIGGERS
+
+# Ways of generating a choice, for params['engine']. Both generate exactly the
+# same choices. 'recursive' calls down a level of Python for every level of
+# nesting, while 'iterative' keeps the levels on a list of its own, so it has
+# no recursion limit and can be paused between steps, see gen_choice_steps.
+RECURSIVE_ENGINE = 'recursive'
+ITERATIVE_ENGINE = 'iterative'
+ENGINES = [RECURSIVE_ENGINE, ITERATIVE_ENGINE]
+
+# Runs a generator, such as gen_choice_steps, to the end, returning what it returns.
+def run_to_end(steps):
+    while True:
+        try:
+            next(steps)
+        except StopIteration as finished:
+            return finished.value
+
+# Raised when a tag has nothing left to pick from, because uniqueness has
+# ruled out its choices or clauses have weighed them down to nothing.
+class ZeroWeightError(AssertionError):
+    pass
 
 # Generates a random choice.
 class ChoiceGenerator():
 
-    def __init__(self, nested_choices):
+    # How many times a generation can go back and pick again after running into
+    # a ZeroWeightError, see gen_for_tag, before giving up on it.
+    MAX_RETRIES = 100
+
+    # rng: A random.Random to draw from, see seeding.make_rng.
+    # profiler: A profiling.PhaseProfiler to time each phase of generation with.
+    # Defaults to the one profiling.profile has made active, if any.
+    def __init__(self, nested_choices, rng=None, profiler=None):
         self.parent = nested_choices
+        self.rng = seeding.make_rng(rng)
+        self.params = {'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}
+        self.data = {}
+        self.reset()
+        self.profiler = profiler if profiler is not None else profiling.active_profiler()
+        if self.profiler is not None:
+            self.profiler.instrument(self)
+
+    # Forgets everything from previous generations, i.e. state and uniqueness.
+    #
+    # base_state: A layered_state.LayeredState to start from a fork of, rather
+    # than from no state.
+    def reset(self, base_state=None):
         self.level = -1
         self.generated_choice = ''
         self.dict_and_choice_backtrace = []
-        self.used_choices = []
-        self.state = defaultdict(int)
-        self.params = {'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}
-        self.data = {}
+        # WeightedChoices that uniqueness has ruled out.
+        self.used_choices = set()
+        # TagGroup to how many of its choices are in used_choices.
+        self.used_counts = {}
+        # TagGroup to a weight_tree.WeightTree of the weights of its unused choices,
+        # for static groups that have had choices ruled out.
+        self.remaining_weights = {}
+        # (TagGroup, WeightedChoice) for each choice put in used_choices, in
+        # order, so a retry can take them out again.
+        self.marks = []
+        self.retries = 0
+        self.state = base_state.fork() if base_state is not None else layered_state.LayeredState()
 
     def gen_choice(self, choices_dict, params):
-        generated_choice = '$'
+        engine = params.get('engine', RECURSIVE_ENGINE)
+        if engine == ITERATIVE_ENGINE:
+            return run_to_end(self.gen_choice_steps(choices_dict, params))
+        if engine != RECURSIVE_ENGINE:
+            raise ValueError(f'Unknown engine "{engine}", expected one of {ENGINES}.')
+
+        self.start_choice(params)
+        generated_choice = self.gen_choice_recursive(choices_dict, choice_template.ROOT_TEMPLATE)
+        return self.finish_choice(generated_choice)
+
+    # The same as gen_choice with the iterative engine, as a generator that
+    # yields each time it starts generating a picked choice, and returns what
+    # gen_choice would. So a generation can be paused, time sliced or
+    # abandoned by iterating it as far as wanted. Subtable calls each happen
+    # within one step. Nothing else can use the generator until it's finished.
+    def gen_choice_steps(self, choices_dict, params):
+        self.start_choice(params)
+        generated_choice = yield from self.run_steps(choices_dict, choice_template.ROOT_TEMPLATE)
+        return self.finish_choice(generated_choice)
+
+    def start_choice(self, params):
+        set_up_logging.refresh_hot_path_logging()
         self.level = 1
         self.dict_and_choice_backtrace = []
         self.params = params
+        self.retries = 0
 
-        generated_choice = self.gen_choice_recursive(choices_dict, generated_choice)
+    def finish_choice(self, generated_choice):
         generated_choice = generated_choice.replace('\\n', '\n')
-        logging.info(f'generated_choice: {generated_choice}')
+        if set_up_logging.HOT_PATH_LOGGING:
+            logging.info(f'generated_choice: {generated_choice}')
 
         return generated_choice, self.state
 
-    def gen_choice_recursive(self, choices_dict, choice_to_expand):
-        if '$' not in choice_to_expand:
+    # template: The choice_template.ChoiceTemplate of the choice to expand.
+    def gen_choice_recursive(self, choices_dict, template):
+        if not template.tags:
+            if template.is_plain:
+                # Nothing to replace or extract.
+                return template.text
             # There were no tags in which to make replacements, so we need to do it now before extracting state data.
             # choice_to_expand = state_clause_handler.replace_state_interpolation(choice_to_expand, None, self.state)
-            choice_to_expand = self.make_replacements(choice_to_expand, None)
+            choice_to_expand = self.make_replacements(template.text, None)
             # logging.debug(f'replaced choice_to_expand after no tags found, level {self.level}: {choice_to_expand}')
             choice_to_expand = self.extract_state(choice_to_expand)
-            logging.debug(f'State: {self.state}')
+            if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+                logging.debug(f'State: {self.state}')
             return choice_to_expand
 
-        choice_to_expand, tags = prepare_tags(choice_to_expand)
+        if template.is_plain:
+            return self.gen_plain_template(choices_dict, template)
 
         # Initial replacement to handle any interpolated values inbetween the start of the choice and the
         # first tag.
         # logging.debug(f'initial pre-state interpolation at level {self.level} choice_to_expand: {choice_to_expand}')
         # choice_to_expand = interpolation_replacements.replace_state_interpolation(choice_to_expand, None, self.state)
         # logging.debug(f'initial pre-state replacements at level {self.level} choice_to_expand: {choice_to_expand}')
-        choice_to_expand = self.make_replacements(choice_to_expand, None)
+        choice_to_expand = self.make_replacements(template.text, None)
         # logging.debug(f'initial choice_to_expand, entering tags: {choice_to_expand}')
 
+        return self.fill_tags(choices_dict, choice_to_expand, template.tags)
+
+    # A plain template has nothing for make_replacements, process_state_tag or
+    # the brace handling to act on, so its choice is just its literals joined
+    # with what each tag generated. That holds as long as no tag generates a '$',
+    # which would be taken for a later tag, so from there on it falls back to
+    # filling the tags in the text.
+    def gen_plain_template(self, choices_dict, template):
+        parts = [template.literals[0]]
+        for i, tag in enumerate(template.tags):
+            recursed_choice = self.gen_for_tag(choices_dict, template.text, tag)
+            if '$' in recursed_choice:
+                choice_to_expand = ''.join(parts) + template.text_from(i)
+                choice_to_expand = self.fill_tag(choice_to_expand, tag, recursed_choice)
+                return self.fill_tags(choices_dict, choice_to_expand, template.tags[i + 1:])
+            parts.append(recursed_choice)
+            parts.append(template.literals[i + 1])
+
+        generated_choice = ''.join(parts)
+        # What the tags generated can still hold state modifications.
+        if '%' in generated_choice:
+            generated_choice = self.extract_state(generated_choice)
+        return generated_choice
+
+    # Each tag's generated text would be copied again by every pass over the
+    # choice for the tags after it, so text that no pass could act on is kept
+    # out of the choice until the end, if it's long enough for that to matter.
+    # Its tag is filled with a one character hole instead, and the holes are
+    # all filled at once before extracting state, the first thing that has to
+    # see the whole text.
+    def fill_tags(self, choices_dict, choice_to_expand, tags):
+        # Ord of each hole to the text it stands in for, or None once holes
+        # can't be told apart from the rest of the choice.
+        holes = None if choice_template.has_holes(choice_to_expand) else {}
         for tag in tags:
             if tag.symbol not in choice_to_expand:
                 # Something has removed this choice, probably a bracket deletion from a null choice.
                 continue
             # logging.info(f'state: {self.state}')
             # logging.debug(f'choice_to_expand, level {self.level}: {choice_to_expand}')
-            filtered_choice_list = self.filter_choices_dict(tag.num, choices_dict)
-            # logging.debug(f'filtered_choice_list, level {self.level}: {filtered_choice_list}')
-            choice_for_tag = self.pick_choice(filtered_choice_list, choice_to_expand, tag)
-            # logging.debug(f'weighed_choice, level {self.level}: {choice_for_tag}')
-            # choice_for_tag.choice = self.make_replacements(choice_for_tag.choice)
-            # logging.debug(f'replaced weighed_choice, level {self.level}: {choice_for_tag}')
-
-            if self.level == self.params['uniqueness_level']:
-                self.used_choices.append(choice_for_tag)
-                self.remove_childless_parents(choice_to_expand, choice_for_tag)
-            elif not choices_dict[choice_for_tag] and self.params['uniqueness_level'] == -1:
-                # If there's nothing in the corresponding list, we're at a leaf node
-                # and are done generating this choice, so uniqueness_level -1 applies.
-                # logging.info(f'appending choice_for_tag {choice_for_tag} to used_choices!')
-                self.used_choices.append(choice_for_tag)
-                self.remove_childless_parents(choice_to_expand, choice_for_tag)
-
-            self.dict_and_choice_backtrace.append((choices_dict, choice_for_tag))
-            self.level += 1
-            recursed_choice = self.gen_choice_recursive(choices_dict[choice_for_tag], choice_for_tag.choice)
-            # logging.debug(f'recursed_choice, level {self.level}: {recursed_choice}')
-            self.dict_and_choice_backtrace.pop()
-            self.level -= 1
-
-            choice_to_expand, state_to_update = state_clause_handler.process_state_tag(choice_to_expand, tag)
-            if state_to_update:
-                # logging.debug(f'Storing value {recursed_choice} into state {state_to_update}.')
-                self.state[state_to_update] = recursed_choice
-
-            # Now that we have all of our state updated from the recursive call,
-            # we can use that information to replace any state interpolations
-            # present between this substitution symbol and the next, or remove
-            # their associated text if they have not been set.
-            # tag_loc = choice_to_expand.find('$')
-            # logging.debug(f'choice_to_expand, pre-state interpolation, level {self.level}: {choice_to_expand}')
-            # logging.debug(f'Doing state interpolation for tag {tag.symbol} on {choice_to_expand}"')
-            # choice_to_expand = state_clause_handler.replace_state_interpolation(choice_to_expand, tag, self.state)
-            # logging.debug(f'Doing replacements for tag {tag.symbol} on {choice_to_expand}"')
-            choice_to_expand = self.make_replacements(choice_to_expand, tag)
-
-            # If the tag is surrounded by brackets, it's a silent call, so we delete it.
-            if f'{{{tag.symbol}}}' in choice_to_expand:
-                choice_to_expand = choice_to_expand.replace(f'{{{tag.symbol}}}', '', 1)
-            else:
-                choice_to_expand = choice_to_expand.replace(tag.symbol, recursed_choice, 1)
+            recursed_choice = self.gen_for_tag(choices_dict, choice_to_expand, tag)
+            choice_to_expand, holes = self.fill_tag_or_hole(choice_to_expand, tag, recursed_choice, holes)
 
             # logging.debug(f'choice_to_expand, level {self.level}: {choice_to_expand}\n\n')
 
+        return self.finish_fill(choice_to_expand, holes)
+
+    # Fills tag with a hole for recursed_choice if it can, otherwise fills it
+    # with recursed_choice, filling any holes first. Returns choice_to_expand
+    # and holes as they are after.
+    def fill_tag_or_hole(self, choice_to_expand, tag, recursed_choice, holes):
+        if holes is not None and self.may_insert_text(choice_to_expand):
+            # The text put in hasn't been checked for holes, so the holes are
+            # filled before it goes in, and only used again if it has none.
+            if holes:
+                choice_to_expand = choice_template.fill_holes(choice_to_expand, holes)
+            choice_to_expand = self.fill_tag(choice_to_expand, tag, recursed_choice)
+            return choice_to_expand, None if choice_template.has_holes(choice_to_expand) else {}
+        if (holes is not None and len(recursed_choice) >= choice_template.MIN_HOLE_LENGTH
+                and len(holes) < choice_template.MAX_HOLES and choice_template.is_inert(recursed_choice)):
+            hole = choice_template.HOLE_START + len(holes)
+            holes[hole] = recursed_choice
+            return self.fill_tag(choice_to_expand, tag, recursed_choice, chr(hole)), holes
+        if holes:
+            choice_to_expand = choice_template.fill_holes(choice_to_expand, holes)
+            holes = None
+        return self.fill_tag(choice_to_expand, tag, recursed_choice), holes
+
+    # Whether make_replacements could put text from elsewhere into
+    # choice_to_expand: a subtable's choices, or a state's value.
+    def may_insert_text(self, choice_to_expand):
+        return (PATTERN_TRIGGERS['subtable_call'] in choice_to_expand
+                or PATTERNS['omni_state_interpolation'].search(choice_to_expand) is not None)
+
+    def finish_fill(self, choice_to_expand, holes):
+        if holes:
+            choice_to_expand = choice_template.fill_holes(choice_to_expand, holes)
         choice_to_expand = self.extract_state(choice_to_expand)
         return choice_to_expand
 
-    def filter_choices_dict(self, tag_num, choices_dict):
-        filtered_choices = []
-        for choice in choices_dict:
-            if choice.tag_num != tag_num:
+    # Picks a choice for tag and generates it, returning the generated text.
+    #
+    # If generating the picked choice runs into a tag with nothing left to pick
+    # from, everything it changed is undone, and another choice is picked
+    # without it. If there's none left, this pick fails in turn, so the one
+    # above it is tried again.
+    def gen_for_tag(self, choices_dict, choice_to_expand, tag):
+        excluded = ()
+        while True:
+            attempt = self.start_attempt()
+            choice_for_tag = None
+            try:
+                choice_for_tag = self.descend(choices_dict, choice_to_expand, tag, excluded)
+                recursed_choice = self.expand_choice(choices_dict[choice_for_tag], choice_for_tag)
+            except ZeroWeightError as error:
+                excluded = self.retry_without(attempt, choice_for_tag, excluded, error)
+                continue
+            except BaseException:
+                self.keep_attempt(attempt)
+                raise
+            # logging.debug(f'recursed_choice, level {self.level}: {recursed_choice}')
+            self.keep_attempt(attempt)
+            self.ascend()
+            return recursed_choice
+
+    # What picking again has to undo: the state, through a snapshot, the
+    # choices uniqueness has ruled out, and how far down the generation is.
+    def start_attempt(self):
+        return self.state, self.state.snapshot(), len(self.marks), self.level, len(self.dict_and_choice_backtrace)
+
+    def keep_attempt(self, attempt):
+        state, snapshot = attempt[:2]
+        state.release(snapshot)
+
+    # Undoes everything since attempt started, and returns excluded with wc
+    # added, for picking again without it. Raises error instead if this pick
+    # failed itself, or the generation is out of retries.
+    def retry_without(self, attempt, wc, excluded, error):
+        state, snapshot, num_marks, level, backtrace_length = attempt
+        state.rollback(snapshot)
+        while len(self.marks) > num_marks:
+            self.unmark_used(*self.marks.pop())
+        self.level = level
+        del self.dict_and_choice_backtrace[backtrace_length:]
+        if wc is None or self.retries >= self.MAX_RETRIES:
+            raise error
+        self.retries += 1
+        return {*excluded, wc}
+
+    # Picks a choice for tag, other than those in excluded, applies uniqueness
+    # to it, and goes down a level into it, returning it.
+    def descend(self, choices_dict, choice_to_expand, tag, excluded=()):
+        choice_for_tag = self.choose_for_tag(choices_dict, choice_to_expand, tag, excluded)
+        # logging.debug(f'weighed_choice, level {self.level}: {choice_for_tag}')
+        # choice_for_tag.choice = self.make_replacements(choice_for_tag.choice)
+        # logging.debug(f'replaced weighed_choice, level {self.level}: {choice_for_tag}')
+
+        if self.level == self.params['uniqueness_level']:
+            self.mark_used(choices_dict.get_group(tag.num), choice_for_tag)
+            self.remove_childless_parents(choice_to_expand, choice_for_tag)
+        elif not choices_dict[choice_for_tag] and self.params['uniqueness_level'] == -1:
+            # If there's nothing in the corresponding list, we're at a leaf node
+            # and are done generating this choice, so uniqueness_level -1 applies.
+            # logging.info(f'appending choice_for_tag {choice_for_tag} to used_choices!')
+            self.mark_used(choices_dict.get_group(tag.num), choice_for_tag)
+            self.remove_childless_parents(choice_to_expand, choice_for_tag)
+
+        self.dict_and_choice_backtrace.append((choices_dict, choice_for_tag))
+        self.level += 1
+        return choice_for_tag
+
+    # Comes back up from the choice descend went into, once it's generated.
+    def ascend(self):
+        self.dict_and_choice_backtrace.pop()
+        self.level -= 1
+
+    # The iterative engine. expand_steps, gen_plain_template_steps,
+    # fill_tags_steps and gen_for_tag_steps do the same as gen_choice_recursive,
+    # gen_plain_template, fill_tags and gen_for_tag, but instead of calling
+    # back into gen_choice_recursive to generate a picked choice, they yield
+    # its children and template to run_steps, which sends back what they
+    # generated.
+
+    # Generates a choice, keeping the choices under it that are still being
+    # generated on a list rather than the call stack. Yields each time it
+    # starts on one.
+    def run_steps(self, choices_dict, template):
+        stack = [self.expand_steps(choices_dict, template)]
+        generated = None
+        error = None
+        while stack:
+            try:
+                if error is None:
+                    children, template = stack[-1].send(generated)
+                else:
+                    children, template = stack[-1].throw(error)
+            except StopIteration as finished:
+                stack.pop()
+                generated = finished.value
+                error = None
+                continue
+            except ZeroWeightError as zero_weight_error:
+                # Passed up to the choice above, the same as it would be
+                # through the call stack.
+                stack.pop()
+                if not stack:
+                    raise
+                error = zero_weight_error
+                continue
+            error = None
+            stack.append(self.expand_steps(children, template))
+            generated = None
+            yield
+        return generated
+
+    def expand_steps(self, choices_dict, template):
+        if not template.tags:
+            # Nothing to pick, so nothing to yield.
+            return self.gen_choice_recursive(choices_dict, template)
+        if template.is_plain:
+            return (yield from self.gen_plain_template_steps(choices_dict, template))
+        choice_to_expand = self.make_replacements(template.text, None)
+        return (yield from self.fill_tags_steps(choices_dict, choice_to_expand, template.tags))
+
+    def gen_plain_template_steps(self, choices_dict, template):
+        parts = [template.literals[0]]
+        for i, tag in enumerate(template.tags):
+            recursed_choice = yield from self.gen_for_tag_steps(choices_dict, template.text, tag)
+            if '$' in recursed_choice:
+                choice_to_expand = ''.join(parts) + template.text_from(i)
+                choice_to_expand = self.fill_tag(choice_to_expand, tag, recursed_choice)
+                return (yield from self.fill_tags_steps(choices_dict, choice_to_expand, template.tags[i + 1:]))
+            parts.append(recursed_choice)
+            parts.append(template.literals[i + 1])
+
+        generated_choice = ''.join(parts)
+        if '%' in generated_choice:
+            generated_choice = self.extract_state(generated_choice)
+        return generated_choice
+
+    def fill_tags_steps(self, choices_dict, choice_to_expand, tags):
+        holes = None if choice_template.has_holes(choice_to_expand) else {}
+        for tag in tags:
+            if tag.symbol not in choice_to_expand:
                 continue
-            if choice in self.used_choices:
+            recursed_choice = yield from self.gen_for_tag_steps(choices_dict, choice_to_expand, tag)
+            choice_to_expand, holes = self.fill_tag_or_hole(choice_to_expand, tag, recursed_choice, holes)
+        return self.finish_fill(choice_to_expand, holes)
+
+    # run_steps throws a ZeroWeightError from the choices under this one in
+    # here, to be retried the same as in gen_for_tag.
+    def gen_for_tag_steps(self, choices_dict, choice_to_expand, tag):
+        excluded = ()
+        while True:
+            attempt = self.start_attempt()
+            choice_for_tag = None
+            try:
+                choice_for_tag = self.descend(choices_dict, choice_to_expand, tag, excluded)
+                recursed_choice = yield choices_dict[choice_for_tag], choice_for_tag.template
+            except ZeroWeightError as error:
+                excluded = self.retry_without(attempt, choice_for_tag, excluded, error)
                 continue
-            filtered_choices.append(choice)
-        return filtered_choices
+            except BaseException:
+                self.keep_attempt(attempt)
+                raise
+            self.keep_attempt(attempt)
+            self.ascend()
+            return recursed_choice
+
+    # Generates the text for a picked choice, given its children.
+    def expand_choice(self, choices_dict, wc):
+        return self.gen_choice_recursive(choices_dict, wc.template)
+
+    # Puts the text generated for tag into choice_to_expand, after handling
+    # anything between it and the next tag that depends on it.
+    #
+    # filling: What to put in the tag's place, if not recursed_choice itself.
+    def fill_tag(self, choice_to_expand, tag, recursed_choice, filling=None):
+        choice_to_expand, state_to_update = state_clause_handler.process_state_tag(choice_to_expand, tag)
+        if state_to_update:
+            # logging.debug(f'Storing value {recursed_choice} into state {state_to_update}.')
+            self.state[state_to_update] = recursed_choice
+
+        # Now that we have all of our state updated from the recursive call,
+        # we can use that information to replace any state interpolations
+        # present between this substitution symbol and the next, or remove
+        # their associated text if they have not been set.
+        # tag_loc = choice_to_expand.find('$')
+        # logging.debug(f'choice_to_expand, pre-state interpolation, level {self.level}: {choice_to_expand}')
+        # logging.debug(f'Doing state interpolation for tag {tag.symbol} on {choice_to_expand}"')
+        # choice_to_expand = state_clause_handler.replace_state_interpolation(choice_to_expand, tag, self.state)
+        # logging.debug(f'Doing replacements for tag {tag.symbol} on {choice_to_expand}"')
+        choice_to_expand = self.make_replacements(choice_to_expand, tag)
+
+        # If the tag is surrounded by brackets, it's a silent call, so we delete it.
+        if f'{{{tag.symbol}}}' in choice_to_expand:
+            choice_to_expand = choice_to_expand.replace(f'{{{tag.symbol}}}', '', 1)
+        else:
+            choice_to_expand = choice_to_expand.replace(tag.symbol, recursed_choice if filling is None else filling, 1)
+        return choice_to_expand
+
+    # excluded: Choices not to pick, besides those uniqueness has ruled out.
+    def choose_for_tag(self, choices_dict, choice_to_expand, tag, excluded=()):
+        group = choices_dict.get_group(tag.num)
+        if excluded:
+            # Only when picking again after a ZeroWeightError, so rare enough
+            # that the choices left can be weighed one by one.
+            filtered_choice_list = [wc for wc in self.filter_choices_dict(tag.num, choices_dict) if wc not in excluded]
+            return self.pick_choice(group, filtered_choice_list, choice_to_expand, tag)
+        if group.is_static and group.total_weight > 0:
+            # None of the weights depend on state, so if uniqueness hasn't ruled any
+            # of them out, we can sample from the group's alias table, and otherwise
+            # from what's left in its WeightTree.
+            if group not in self.remaining_weights:
+                return group.choices[group.alias_table.sample(self.rng)]
+            return self.pick_remaining_choice(group, choice_to_expand, tag)
+
+        filtered_choice_list = self.filter_choices_dict(tag.num, choices_dict)
+        # logging.debug(f'filtered_choice_list, level {self.level}: {filtered_choice_list}')
+        return self.pick_choice(group, filtered_choice_list, choice_to_expand, tag)
+
+    def filter_choices_dict(self, tag_num, choices_dict):
+        group = choices_dict.get_group(tag_num)
+        if not self.used_counts.get(group):
+            return group.choices
+        return [choice for choice in group.choices if choice not in self.used_choices]
+
+    def mark_used(self, group, wc):
+        if wc in self.used_choices:
+            return
+        self.used_choices.add(wc)
+        self.marks.append((group, wc))
+        self.used_counts[group] = self.used_counts.get(group, 0) + 1
+        if group.is_static:
+            if group not in self.remaining_weights:
+                self.remaining_weights[group] = weight_tree.WeightTree(group.weights)
+            self.remaining_weights[group].subtract(group.indices[wc], wc.weight)
+
+    # Undoes mark_used, for a retry.
+    def unmark_used(self, group, wc):
+        self.used_choices.discard(wc)
+        self.used_counts[group] -= 1
+        if group.is_static:
+            if self.used_counts[group]:
+                self.remaining_weights[group].subtract(group.indices[wc], -wc.weight)
+            else:
+                del self.remaining_weights[group]
+
+    def is_exhausted(self, group):
+        return self.used_counts.get(group, 0) == len(group.choices)
 
     # generated_choice: A choice generated during the recursion process which
     # is fully generated. (i.e. has no more '$' in it.)
     def extract_state(self, generated_choice):
-        state_pattern = re.compile(STATE_REGEXES['omni_state_modification'])
+        if PATTERN_TRIGGERS['omni_state_modification'] not in generated_choice:
+            return generated_choice
+        state_pattern = PATTERNS['omni_state_modification']
         match = state_pattern.search(generated_choice)
         if match:
             base_result = generated_choice[:match.start()]
@@ -164,43 +497,70 @@ class ChoiceGenerator():
     # are nested dicts of the same form. The only keys that aren't dicts with WC keys
     # are empty dicts.
     #
-    # self.used_choices: List of WeightedChoice objects.
+    # self.used_choices: Set of WeightedChoice objects.
     def remove_childless_parents(self, choice_to_expand, removed_weighted_choice):
         for dict, weighted_choice in self.dict_and_choice_backtrace[::-1]:
             # logging.info(f'Removed {removed_weighted_choice}, going after its childless parents while creating level {self.level} choice {choice_to_expand}. wc: {weighted_choice}, dict: {choices_util.recursive_dict_print(dict)} used_choices: {self.used_choices}')
-            tag_filtered_choices = [wc for wc in dict[weighted_choice].keys() if wc.tag_num == removed_weighted_choice.tag_num]
-            # logging.info(f'tfc: {tag_filtered_choices}')
-            unused_tag_filtered_choices = list(filter(lambda d: d not in self.used_choices, tag_filtered_choices))
-            if len(unused_tag_filtered_choices) != 0:
-                # logging.info(f'not all choices in {unused_tag_filtered_choices} were used, breaking!')
+            if not self.is_exhausted(dict[weighted_choice].get_group(removed_weighted_choice.tag_num)):
+                # logging.info(f'not all choices in the group were used, breaking!')
                 break
             # logging.info(f'Adding {weighted_choice} to the used_choices list!')
-            self.used_choices.append(weighted_choice)
+            self.mark_used(dict.get_group(weighted_choice.tag_num), weighted_choice)
             removed_weighted_choice = weighted_choice
 
     def make_replacements(self, choice_to_expand, tag):
         # logging.debug(f'Making replacements on {choice_to_expand} for tag {tag}.')
-        choice_to_expand, state = range_replacements.replace_ranges(choice_to_expand, tag, self.state)
-        self.state = state
-        choice_to_expand = interpolation_replacements.replace_state_interpolation(choice_to_expand, tag, self.state)
-        choice_to_expand, state = subtable_calls.make_subtable_calls(self.parent, choice_to_expand, tag, self.state)
-        self.state = state
+        choice_to_expand = self.replace_ranges(choice_to_expand, tag)
+        choice_to_expand = self.replace_state_interpolation(choice_to_expand, tag)
+        choice_to_expand = self.make_subtable_calls(choice_to_expand, tag)
         # logging.debug(f'Finished making replacements: {choice_to_expand} for tag {tag}.')
 
         return choice_to_expand
 
-    def pick_choice(self, filtered_choices, choice_to_expand, tag):
-        clause_modded_weights_by_uuid = {wc.uuid: self.get_clause_modded_weight(wc) for wc in filtered_choices}
-        total_weight = sum(clause_modded_weights_by_uuid.values())
-        assert total_weight > 0, f'Total weight was <= 0, most likely you wrote a generation that removed all valid choices from a config, or didn\'t add enough subchoices. Choices given were: {filtered_choices}, at level {self.level}, with used_choices of {self.used_choices}, tag: {tag}, choice_to_expand: {choice_to_expand}'
-        rand = random.randint(1, total_weight)
+    def replace_ranges(self, choice_to_expand, tag):
+        choice_to_expand, state = range_replacements.replace_ranges(choice_to_expand, tag, self.state, self.rng)
+        self.state = state
+        return choice_to_expand
+
+    def replace_state_interpolation(self, choice_to_expand, tag):
+        return interpolation_replacements.replace_state_interpolation(choice_to_expand, tag, self.state)
+
+    def make_subtable_calls(self, choice_to_expand, tag):
+        choice_to_expand, state = subtable_calls.make_subtable_calls(self.parent, choice_to_expand, tag, self.state, self.rng, self.params.get('engine'))
+        self.state = state
+        return choice_to_expand
 
-        for wc in filtered_choices:
-            rand -= clause_modded_weights_by_uuid[wc.uuid]
+    # Picks the first choice whose running total of weights reaches a random
+    # number up to the total weight. Static groups with any weight are sampled
+    # in choose_for_tag instead.
+    #
+    # filtered_choices: The choices in group that can still be picked.
+    def pick_choice(self, group, filtered_choices, choice_to_expand, tag):
+        # Clause weights depend on state, and can be negative, so they're
+        # worked out and walked through each time.
+        weights = [self.get_clause_modded_weight(wc) for wc in filtered_choices]
+        total_weight = sum(weights)
+        self.check_total_weight(total_weight, filtered_choices, choice_to_expand, tag)
+        rand = self.rng.randint(1, total_weight)
+        for wc, weight in zip(filtered_choices, weights):
+            rand -= weight
             if rand <= 0:
                 return wc
         raise ValueError(f'Failed to select a choice when provided {filtered_choices}.')
 
+    def check_total_weight(self, total_weight, filtered_choices, choice_to_expand, tag):
+        if total_weight <= 0:
+            raise ZeroWeightError(f'Total weight was <= 0, most likely you wrote a generation that removed all valid choices from a config, or didn\'t add enough subchoices. Choices given were: {filtered_choices}, at level {self.level}, with used_choices of {self.used_choices}, tag: {tag}, choice_to_expand: {choice_to_expand}')
+
+    # Picks from a static group that has had choices ruled out, using the weights
+    # left in its WeightTree.
+    def pick_remaining_choice(self, group, choice_to_expand, tag):
+        remaining_weights = self.remaining_weights[group]
+        if remaining_weights.total <= 0:
+            raise ZeroWeightError(f'Total weight was <= 0, most likely you wrote a generation that removed all valid choices from a config, or didn\'t add enough subchoices. Choices given were: {[wc for wc in group.choices if wc not in self.used_choices]}, at level {self.level}, with used_choices of {self.used_choices}, tag: {tag}, choice_to_expand: {choice_to_expand}')
+        rand = self.rng.randint(1, remaining_weights.total)
+        return group.choices[remaining_weights.find(rand)]
+
     def get_clause_modded_weight(self, wc):
         # if not wc.clause_list:
         #     return wc.weight
@@ -208,24 +568,56 @@ class ChoiceGenerator():
         # for clause in wc.clause_list:
         #     clause_modded_weight = state_clause_handler.evaluate_value_modification(clause, clause_modded_weight, self.state)
         # return clause_modded_weight
-        if not wc.clause:
+        if not wc.value_modification:
             return wc.weight
         # clause_modded_weight = wc.weight
         # for clause in wc.clause_list:
-        clause_modded_weight = state_clause_handler.evaluate_value_modification(wc.clause, wc.weight, self.state)
+        clause_modded_weight = wc.value_modification.apply(wc.weight, self.state)
         return clause_modded_weight
 
-def prepare_tags(choice_to_expand):
-    num_tags = choice_to_expand.count('$')
-    tags = []
-    for i in range(1, num_tags+1):
-        symbol = f'$[{i}]'
-        tags.append(Tag(i, symbol))
-        if symbol not in choice_to_expand:
-            match = re.search('\$(?!\[\d+\])', choice_to_expand)
-            choice_to_expand = choice_to_expand[:match.start()] + symbol + choice_to_expand[match.start()+1:]
-    return choice_to_expand, tags
 
+# Idle ChoiceGenerators for one table, so that the many short generations
+# subtable calls make reuse a generator instead of building one each time. A
+# generator is only ever used by whoever acquired it, so a table that's called
+# again while it's generating, such as through a subtable that calls back into
+# it, just gets another one.
+class GeneratorPool():
+
+    # How many idle generators to keep. More are only needed while a table is
+    # nested in itself, and are made as needed.
+    MAX_IDLE = 4
+
+    def __init__(self, nested_choices):
+        self.nested_choices = nested_choices
+        self.idle = []
+
+    # A generator that has forgotten everything from previous generations, as
+    # a new one would have, drawing from rng.
+    def acquire(self, rng=None):
+        while True:
+            # Pools of cached tables are shared between threads, so another one
+            # can take the last idle generator after it's been checked for.
+            try:
+                generator = self.idle.pop()
+            except IndexError:
+                break
+            # Generators report to the profiler that was active when they were
+            # made, so they're only reused while it still is.
+            if generator.profiler is profiling.active_profiler():
+                generator.reset()
+                generator.rng = seeding.make_rng(rng)
+                return generator
+        return ChoiceGenerator(self.nested_choices, rng)
+
+    # Returns a generator from acquire once nothing is going to use it or its
+    # state any more.
+    def release(self, generator):
+        if len(self.idle) < self.MAX_IDLE:
+            self.idle.append(generator)
+
+    # Idle generators are only worth keeping in the process that made them.
+    def __getstate__(self):
+        return {'nested_choices': self.nested_choices, 'idle': []}
 
 # if __name__ == '__main__':
 #     set_up_logging.set_up_logging()
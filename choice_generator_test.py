@@ -0,0 +1,156 @@
+import logging
+import sys
+import unittest
+from unittest import mock
+
+import choice_generator
+from choice_template import Tag
+from nested_choices import ChoiceDict, NestedChoices, TagGroup, WeightedChoice
+
+# A table that nests one choice in the next, depth levels deep.
+def make_deep_table(depth):
+    choices_dict = ChoiceDict({WeightedChoice(1, 'end'): ChoiceDict()})
+    for _ in range(depth - 1):
+        choices_dict = ChoiceDict({WeightedChoice(1, 'a $'): choices_dict})
+    return NestedChoices('deep', choices_dict)
+
+class FixedRandom():
+
+    def __init__(self, value):
+        self.value = value
+
+    def randint(self, a, b):
+        assert a <= self.value <= b
+        return self.value
+
+def make_group(choices):
+    group = TagGroup(1)
+    for wc in choices:
+        group.add(wc)
+    return group
+
+class PickChoiceTestCase(unittest.TestCase):
+
+    # Which choice each possible draw picks, as indices.
+    def picks(self, group, state={}):
+        generator = choice_generator.ChoiceGenerator(make_deep_table(1))
+        generator.state.update(state)
+        total_weight = sum(generator.get_clause_modded_weight(wc) for wc in group.choices)
+        picks = []
+        for rand in range(1, total_weight + 1):
+            generator.rng = FixedRandom(rand)
+            picks.append(group.indices[generator.pick_choice(group, group.choices, '', Tag(1, '$[1]'))])
+        return picks
+
+    def test_static(self):
+        group = make_group([WeightedChoice(weight, str(i)) for i, weight in enumerate([2, 0, 3, 1])])
+        self.assertEqual(self.picks(group), [0, 0, 2, 2, 2, 3])
+
+    def test_clauses(self):
+        group = make_group([WeightedChoice(2, 'a'), WeightedChoice(1, 'b', clause='%wealth>5->+=wealth*2%'), WeightedChoice(1, 'c')])
+        self.assertEqual(self.picks(group), [0, 0, 1, 2])
+        self.assertEqual(self.picks(group, {'wealth': 6}), [0, 0] + [1] * 13 + [2])
+
+    def test_negative_weights(self):
+        group = make_group([WeightedChoice(3, 'a'), WeightedChoice(-2, 'b'), WeightedChoice(2, 'c')])
+        self.assertEqual(self.picks(group), [0, 0, 0])
+
+# A table where picking 'dead' always runs into a tag with nothing to pick,
+# after calling a subtable that changes state and filling a tag whose choice
+# uniqueness rules out.
+def make_dead_end_table():
+    choices_string = '1 $\n  1 dead @counter $ $\n    1 x\n    $\n    1%*=0% nothing\n  1 alive'
+    nested_choices = NestedChoices('dead_end', NestedChoices.choices_string_to_tree(choices_string))
+    nested_choices.register_subtable(NestedChoices.load_from_string_list('counter', ['seen %count:+=1%']))
+    return nested_choices
+
+class RetryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_picks_again(self):
+        nested_choices = make_dead_end_table()
+        retries = 0
+        for engine in choice_generator.ENGINES:
+            for seed in range(10):
+                generator = choice_generator.ChoiceGenerator(nested_choices, seed)
+                params = {'num': 1, 'uniqueness_level': -1, 'engine': engine}
+                # Everything 'dead' did is undone.
+                self.assertEqual(generator.gen_choice(nested_choices.choices, params), ('alive', {}))
+                self.assertEqual([wc.choice for wc in generator.used_choices], ['alive'])
+                self.assertEqual((generator.level, generator.dict_and_choice_backtrace), (1, []))
+                self.assertIsNone(generator.state.journal)
+                retries += generator.retries
+        self.assertGreater(retries, 0)
+
+    def test_nothing_left(self):
+        nested_choices = NestedChoices('dead_end', NestedChoices.choices_string_to_tree('1 $\n  1 dead $\n    1%*=0% nothing'))
+        for engine in choice_generator.ENGINES:
+            generator = choice_generator.ChoiceGenerator(nested_choices, 0)
+            with self.assertRaises(choice_generator.ZeroWeightError):
+                generator.gen_choice(nested_choices.choices, {'num': 1, 'uniqueness_level': 0, 'engine': engine})
+            self.assertIsNone(generator.state.journal)
+
+    def test_out_of_retries(self):
+        nested_choices = make_dead_end_table()
+        with mock.patch.object(choice_generator.ChoiceGenerator, 'MAX_RETRIES', 0):
+            with self.assertRaises(AssertionError):
+                for seed in range(10):
+                    nested_choices.gen_choices({'num': 1, 'uniqueness_level': 0}, rng=seed)
+
+class EngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_engines_generate_the_same(self):
+        for filename in ['random_street.txt', 'random_npc.txt', 'random_items.txt', 'shop_interiors.txt', 'test_places.txt']:
+            nested_choices = NestedChoices.load_from_file(filename)
+            nested_choices.register_subtable(NestedChoices.load_from_string_list('countries_table', ['Germany', 'France', 'UK']))
+            for seed in range(10):
+                params = {'num': 3, 'uniqueness_level': seed % 3 - 1}
+                try:
+                    expected = nested_choices.gen_choices(params, rng=seed)
+                except AssertionError:
+                    # Uniqueness ran out of choices, which it does the same either way.
+                    with self.assertRaises(AssertionError):
+                        nested_choices.gen_choices(dict(params, engine='iterative'), rng=seed)
+                    continue
+                self.assertEqual(nested_choices.gen_choices(dict(params, engine='iterative'), rng=seed), expected, f'{filename} {seed}')
+
+    def test_batch(self):
+        nested_choices = NestedChoices.load_from_file('random_npc.txt')
+        expected = nested_choices.gen_batch(20, seed=3)
+        self.assertEqual(nested_choices.gen_batch(20, seed=3, params={'uniqueness_level': 0, 'engine': 'iterative'}), expected)
+
+    def test_deeper_than_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 2
+        nested_choices = make_deep_table(depth)
+        params = {'num': 1, 'uniqueness_level': 0, 'engine': 'iterative'}
+        self.assertEqual(nested_choices.gen_choices(params, rng=0), ['a ' * (depth - 1) + 'end'])
+        with self.assertRaises(RecursionError):
+            nested_choices.gen_choices(dict(params, engine='recursive'), rng=0)
+
+    def test_pause_and_resume(self):
+        nested_choices = make_deep_table(5)
+        generator = choice_generator.ChoiceGenerator(nested_choices, 0)
+        steps = generator.gen_choice_steps(nested_choices.choices, {'num': 1, 'uniqueness_level': 0})
+        for _ in range(5):
+            next(steps)
+        self.assertEqual(generator.level, 6)
+        self.assertEqual(choice_generator.run_to_end(steps), ('a a a a end', {}))
+
+    def test_unknown_engine(self):
+        nested_choices = make_deep_table(2)
+        with self.assertRaises(ValueError):
+            nested_choices.gen_choices({'num': 1, 'uniqueness_level': 0, 'engine': 'sideways'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import functools
+import re
+
+from state_regexes import PATTERNS
+
+# Characters that start a range, state clause, subtable call or brace group.
+# Choices without any of them are plain: just text and tags.
+SPECIAL_CHARS = '%[]@{}'
+# Holes stand in for generated text while the rest of a choice is filled, see
+# ChoiceGenerator.fill_tags. Each is one character from Unicode's private use
+# area, which choices files have no reason to contain.
+# Shorter text is cheaper to copy than to check.
+MIN_HOLE_LENGTH = 64
+HOLE_START = 0xE000
+MAX_HOLES = 0xF8FF - HOLE_START + 1
+HOLE_RE = re.compile('[\ue000-\uf8ff]')
+# Text with none of these can't be acted on by any replacement pass, nor be
+# mistaken for a hole.
+NOT_INERT_RE = re.compile('[' + re.escape(SPECIAL_CHARS + '$') + '\ue000-\uf8ff]')
+
+class Tag():
+
+    def __init__(self, num, symbol):
+        self.num = num
+        self.symbol = symbol
+
+    def __str__(self):
+        return self.symbol
+
+    def __repr__(self):
+        return self.__str__()
+
+# A choice's text, prepared once when the choice is loaded rather than every
+# time it's generated.
+#
+# text: The choice text, with every tag numbered, as from prepare_tags.
+# tags: The Tags in text, in order.
+# literals: For plain templates, the text around the tags, one more than there
+# are tags, so the generated choice is the literals joined with what each tag
+# generated. None otherwise.
+class ChoiceTemplate():
+
+    def __init__(self, text, tags, literals):
+        self.text = text
+        self.tags = tags
+        self.literals = literals
+
+    @property
+    def is_plain(self):
+        return self.literals is not None
+
+    # The text from the tag at index onwards, as it is before that tag is filled.
+    def text_from(self, index):
+        return ''.join(self.tags[i].symbol + self.literals[i + 1] for i in range(index, len(self.tags)))
+
+    def __repr__(self):
+        return f'ChoiceTemplate({self.text!r})'
+
+# How many distinct choice texts to keep templates for. Each choice keeps its
+# own template, so this only decides how many can be shared by choices loaded
+# later, and bounds what is kept once their tables are gone.
+MAX_SHARED_TEMPLATES = 16384
+
+# Choices often share text, such as the tables' many plain '$'s, so they share
+# templates too.
+@functools.lru_cache(maxsize=MAX_SHARED_TEMPLATES)
+def compile_template(choice_text):
+    if '$' in choice_text:
+        text, tags = prepare_tags(choice_text)
+    else:
+        text, tags = choice_text, []
+
+    literals = None
+    if not any(c in choice_text for c in SPECIAL_CHARS):
+        literals = []
+        start = 0
+        for tag in tags:
+            tag_start = text.index(tag.symbol, start)
+            literals.append(text[start:tag_start])
+            start = tag_start + len(tag.symbol)
+        literals.append(text[start:])
+    return ChoiceTemplate(text, tuple(tags), literals)
+
+def prepare_tags(choice_to_expand):
+    num_tags = choice_to_expand.count('$')
+    tags = []
+    for i in range(1, num_tags+1):
+        symbol = f'$[{i}]'
+        tags.append(Tag(i, symbol))
+        if symbol not in choice_to_expand:
+            match = PATTERNS['unnumbered_tag'].search(choice_to_expand)
+            choice_to_expand = choice_to_expand[:match.start()] + symbol + choice_to_expand[match.start()+1:]
+    return choice_to_expand, tags
+
+def has_holes(text):
+    return HOLE_RE.search(text) is not None
+
+def is_inert(text):
+    return NOT_INERT_RE.search(text) is None
+
+# holes: Dict of each hole's ord to the text it stands in for, as
+# str.translate takes.
+def fill_holes(text, holes):
+    return text.translate(holes)
+
+ROOT_TEMPLATE = compile_template('$')
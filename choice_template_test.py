@@ -0,0 +1,109 @@
+import logging
+import unittest
+from unittest import mock
+
+import choice_generator
+import choice_template
+from nested_choices import NestedChoices
+
+class CompileTemplateTestCase(unittest.TestCase):
+
+    def test_plain(self):
+        template = choice_template.compile_template('A $ street, next to $.')
+        self.assertEqual(template.text, 'A $[1] street, next to $[2].')
+        self.assertEqual([tag.symbol for tag in template.tags], ['$[1]', '$[2]'])
+        self.assertEqual(template.literals, ['A ', ' street, next to ', '.'])
+        self.assertEqual(template.text_from(1), '$[2].')
+
+    def test_no_tags(self):
+        template = choice_template.compile_template('plain text')
+        self.assertEqual(template.tags, ())
+        self.assertEqual(template.literals, ['plain text'])
+
+    def test_numbered_tags(self):
+        template = choice_template.compile_template('$[2] then $')
+        self.assertEqual(template.text, '$[2] then $[1]')
+        self.assertFalse(template.is_plain)
+
+    def test_special(self):
+        for text in ['$ %wealth:+=1%', '[1-6] $', '@colors $', '{$}', '%home%']:
+            self.assertFalse(choice_template.compile_template(text).is_plain, text)
+
+    def test_shared(self):
+        self.assertIs(choice_template.compile_template('$'), choice_template.ROOT_TEMPLATE)
+
+    # Templates of tables that are gone aren't all kept for good.
+    def test_bounded(self):
+        self.assertEqual(choice_template.compile_template.cache_info().maxsize, choice_template.MAX_SHARED_TEMPLATES)
+
+
+# Every template rendered as a non-plain one, by filling its tags in the text.
+def gen_without_plain_templates(nested_choices, params, rng):
+    with mock.patch.object(choice_template.ChoiceTemplate, 'is_plain', property(lambda template: False)):
+        return nested_choices.gen_choices(params, rng=rng)
+
+class PlainTemplateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_matches_filling_tags(self):
+        for filename in ['random_street.txt', 'random_npc.txt', 'random_items.txt', 'shop_interiors.txt']:
+            nested_choices = NestedChoices.load_from_file(filename)
+            for seed in range(10):
+                params = {'num': 3, 'uniqueness_level': seed % 3 - 1}
+                try:
+                    expected = gen_without_plain_templates(nested_choices, params, seed)
+                except AssertionError:
+                    # Uniqueness ran out of choices, which it does the same either way.
+                    with self.assertRaises(AssertionError):
+                        nested_choices.gen_choices(params, rng=seed)
+                    continue
+                self.assertEqual(nested_choices.gen_choices(params, rng=seed), expected, f'{filename} {seed}')
+
+class HolesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_is_inert(self):
+        self.assertTrue(choice_template.is_inert('a quiet street'))
+        for text in ['$', 'seen %count%', '[1-6]', '@colors', '{maybe}', 'a \ue000 hole']:
+            self.assertFalse(choice_template.is_inert(text), text)
+
+    def test_fill_holes(self):
+        holes = {choice_template.HOLE_START: 'one', choice_template.HOLE_START + 1: 'two'}
+        self.assertEqual(choice_template.fill_holes('\ue000 and \ue001.', holes), 'one and two.')
+
+    # Filling every tag through a hole, and through none, generate the same.
+    def test_matches_filling_directly(self):
+        for filename in ['random_street.txt', 'random_npc.txt', 'test_places.txt']:
+            nested_choices = NestedChoices.load_from_file(filename)
+            nested_choices.register_subtable(NestedChoices.load_from_string_list('countries_table', ['Germany', 'France', 'UK']))
+            for seed in range(10):
+                params = {'num': 3, 'uniqueness_level': 0}
+                with mock.patch.object(choice_template, 'MIN_HOLE_LENGTH', 10 ** 9):
+                    expected = gen_without_plain_templates(nested_choices, params, seed)
+                with mock.patch.object(choice_template, 'MIN_HOLE_LENGTH', 0):
+                    self.assertEqual(gen_without_plain_templates(nested_choices, params, seed), expected, f'{filename} {seed}')
+
+    # Text that goes in after a hole has been handed out can have characters
+    # that look like holes, which have to come through as they are.
+    def test_inserted_hole_characters(self):
+        choices_tree = NestedChoices.choices_string_to_tree('1 $ then @marks and %mark%\n  1 some inert text')
+        nested_choices = NestedChoices('holes', choices_tree)
+        nested_choices.register_subtable(NestedChoices.load_from_string_list('marks', ['\ue000']))
+        for engine in choice_generator.ENGINES:
+            params = {'num': 1, 'uniqueness_level': 0, 'engine': engine}
+            with mock.patch.object(choice_template, 'MIN_HOLE_LENGTH', 0):
+                generated = nested_choices.gen_batch(1, seed=0, params=params, initial_state={'mark': '\ue001'})
+            self.assertEqual(generated, ['some inert text then \ue000 and \ue001'], engine)
+
+if __name__ == '__main__':
+    unittest.main()
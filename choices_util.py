@@ -1,37 +1,81 @@
+import bisect
+import functools
 import logging
 import re
 import set_up_logging
 
+# How many lines' BracketIndexes to keep. A line is looked up once for every
+# match in it, and changes each time a match is replaced.
+BRACKET_INDEX_CACHE_SIZE = 256
+
+# The nearest unmatched lbrace at or before position, and the nearest unmatched
+# rbrace at or after it, or None for either that isn't there.
 def get_enclosing_braces(position, line, lbrace='{', rbrace='}'):
     # logging.debug(f'Checking if position {position}, at the center of "{line[position-3:position+4]}" in line "{line}" is contained in braces.')
-    lloc = None
-    rloc = None
-    i = position
-    rbrace_count = 0
-    while i >= 0:
-        if line[i] == lbrace:
-            rbrace_count -= 1
-            if rbrace_count < 0:
-                lloc = i
-                break
-        elif line[i] == rbrace:
-            rbrace_count += 1
-        i -= 1
-
-    i = position
-    lbrace_count = 0
-    while i < len(line):
-        if line[i] == rbrace:
-            lbrace_count -= 1
-            if lbrace_count < 0:
-                rloc = i
-                break
-        elif line[i] == lbrace:
-            lbrace_count += 1
-        i += 1
-
-    # logging.debug(f'lloc: {lloc}, rloc: {rloc}')
-    return lloc, rloc
+    if lbrace not in line and rbrace not in line:
+        return None, None
+    return bracket_index(line, lbrace, rbrace).enclosing(position)
+
+@functools.lru_cache(maxsize=BRACKET_INDEX_CACHE_SIZE)
+def bracket_index(line, lbrace, rbrace):
+    return BracketIndex(line, lbrace, rbrace)
+
+# Finds the braces enclosing any position in a line with binary searches over
+# its braces, rather than scanning out from the position character by
+# character each time, which made processing a choice with many brace clauses
+# quadratic in its length.
+#
+# The enclosing lbrace of a position is the last lbrace at or before it with
+# one fewer brace open before it than are open just after the position, and
+# the enclosing rbrace is the first rbrace at or after it with as many open
+# before it as are open just before the position.
+class BracketIndex():
+
+    def __init__(self, line, lbrace, rbrace):
+        # Every brace's position, and how many braces are open just after it.
+        self.positions = []
+        self.depths = []
+        # How many braces are open before a brace to the ascending positions of
+        # the lbraces and rbraces with that many.
+        self.lbraces = {}
+        self.rbraces = {}
+        depth = 0
+        for match in brace_pattern(lbrace, rbrace).finditer(line):
+            position = match.start()
+            if match.group() == lbrace:
+                self.lbraces.setdefault(depth, []).append(position)
+                depth += 1
+            else:
+                self.rbraces.setdefault(depth, []).append(position)
+                depth -= 1
+            self.positions.append(position)
+            self.depths.append(depth)
+
+    def enclosing(self, position):
+        i = bisect.bisect_left(self.positions, position)
+        depth_before = self.depths[i - 1] if i else 0
+        depth_after = depth_before
+        if i < len(self.positions) and self.positions[i] == position:
+            depth_after = self.depths[i]
+
+        lloc = None
+        lbraces = self.lbraces.get(depth_after - 1)
+        if lbraces:
+            j = bisect.bisect_right(lbraces, position) - 1
+            if j >= 0:
+                lloc = lbraces[j]
+
+        rloc = None
+        rbraces = self.rbraces.get(depth_before)
+        if rbraces:
+            j = bisect.bisect_left(rbraces, position)
+            if j < len(rbraces):
+                rloc = rbraces[j]
+        return lloc, rloc
+
+@functools.lru_cache(maxsize=None)
+def brace_pattern(lbrace, rbrace):
+    return re.compile(f'[{re.escape(lbrace)}{re.escape(rbrace)}]')
 
 def split_into_lines(s):
     return re.split('\r?\n', s)
@@ -50,7 +94,8 @@ def handle_brace_enclosure(target, to_replace, delete_all=False, lbrace='{', rbr
     if any([open, close]):
         assert open != None and close != None, f'Enclosing braces for target {target} in replacement string {to_replace} were not both found. Returned locations were {open}, {close}.'
         if delete_all:
-            logging.debug(f'braces found, removing everything in {to_replace[open:close+1]}')
+            if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+                logging.debug(f'braces found, removing everything in {to_replace[open:close+1]}')
             to_replace = to_replace[:open] + to_replace[close+1:]
         else:
             # Remove the braces.
@@ -72,7 +117,8 @@ def find_endpoint_for_interpolation(to_replace, start):
 def get_next_match(to_replace, pattern, start):
     end = find_endpoint_for_interpolation(to_replace, start)
     # logging.debug(f'Getting next match for {pattern} in range {to_replace[start:end]}')
-    logging.debug(f'Searching over "{to_replace[start:end]}"')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Searching over "{to_replace[start:end]}"')
     match = pattern.search(to_replace, start, end)
     # logging.debug(f'Found match {match}.')
     return match
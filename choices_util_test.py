@@ -0,0 +1,41 @@
+import random
+import unittest
+
+import choices_util
+
+# Scans out from position, as get_enclosing_braces used to.
+def scan_for_enclosing_braces(position, line, lbrace, rbrace):
+    lloc = rloc = None
+    count = 0
+    for i in range(position, -1, -1):
+        count += {lbrace: -1, rbrace: 1}.get(line[i], 0)
+        if count < 0:
+            lloc = i
+            break
+    count = 0
+    for i in range(position, len(line)):
+        count += {rbrace: -1, lbrace: 1}.get(line[i], 0)
+        if count < 0:
+            rloc = i
+            break
+    return lloc, rloc
+
+class GetEnclosingBracesTestCase(unittest.TestCase):
+
+    def test_examples(self):
+        self.assertEqual(choices_util.get_enclosing_braces(3, '0{234}'), (1, 5))
+        self.assertEqual(choices_util.get_enclosing_braces(3, '0[234]'), (None, None))
+        self.assertEqual(choices_util.get_enclosing_braces(3, '0[234]', '[', ']'), (1, 5))
+        self.assertEqual(choices_util.get_enclosing_braces(5, '0{2}{567{}}'), (4, 10))
+        self.assertEqual(choices_util.get_enclosing_braces(4, '0{2}4{6'), (None, None))
+
+    def test_matches_scanning(self):
+        rand = random.Random(0)
+        for _ in range(2000):
+            line = ''.join(rand.choice('{}[]ab') for _ in range(rand.randint(1, 12)))
+            position = rand.randrange(len(line))
+            for lbrace, rbrace in [('{', '}'), ('[', ']')]:
+                self.assertEqual(choices_util.get_enclosing_braces(position, line, lbrace, rbrace), scan_for_enclosing_braces(position, line, lbrace, rbrace), f'{line!r} at {position}')
+
+if __name__ == '__main__':
+    unittest.main()
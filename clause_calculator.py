@@ -1,5 +1,7 @@
+import functools
 import logging
 import math
+import operator
 import re
 
 import set_up_logging
@@ -28,14 +30,48 @@ BOOLEAN_PRIORITY = {'(': 10, '==': 8, '!=': 8, '<':8, '>': 8, '>=': 8, '<=': 8,
 COMPARISON_SYMBOLS = '!=<>|&'
 OPERAND_TOKENS = COMPARISON_SYMBOLS + '()^*/+-UM'
 
+# How many distinct clauses to keep compiled. Clauses come from the tables, so
+# this is far more than a normal set of tables has.
+MAX_COMPILED_CLAUSES = 4096
+
+BINARY_OPERATIONS = {
+    '^': operator.pow,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '+': operator.add,
+    '-': operator.sub,
+    '||': lambda lhs, rhs: lhs or rhs,
+    '&&': lambda lhs, rhs: lhs and rhs,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
 def calculate(clause, state):
-    logging.debug(f'Calculating value of expression "{clause}", with state {state}.')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Calculating value of expression "{clause}", with state {state}.')
 
     # TODO: Returning empty strings doesn't work properly, and the value comes back as None instead of ''.
     if not clause:
-        logging.debug('Returning empty string.')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug('Returning empty string.')
         return ''
 
+    result = compile_clause(clause)(state)
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Calculated value of {result} for clause {clause}.')
+    return result
+
+# Parses a clause once, returning a function that takes the state and returns
+# the clause's value, so that calculating the same clause again is just a few
+# calls. Every state value a clause uses is still read from the state, in the
+# order it appears in the clause, each time it's calculated.
+@functools.lru_cache(maxsize=MAX_COMPILED_CLAUSES)
+def compile_clause(clause):
+    logging.debug(f'Compiling expression "{clause}".')
     op_stack = []
     val_stack = []
 
@@ -52,7 +88,6 @@ def calculate(clause, state):
         if i >= len(clause):
             break
         c = clause[i]
-        logging.debug(f'c: {c}, op_stack: {op_stack}, val_stack: {val_stack}, token: `{token}`, quoted: {quoted}')
 
         if c == '"':
             quoted = not quoted
@@ -84,80 +119,30 @@ def calculate(clause, state):
 
         if token:
             if token[-1] == '"':
-                val = token[1:-1]
+                val_stack.append(compile_constant(token[1:-1]))
             else:
                 try:
-                    val = float(token)
+                    val_stack.append(compile_constant(float(token)))
                 except ValueError:
-                    if token not in state.keys():
-                        logging.info(f'Accessing token {token} that is not present in state {state}! This may be intentional use of the default property, or you may be using a token that is not yet defined. (Did you double check your spelling?)')
-                    val = state[token]
-                    try:
-                        val = float(val)
-                    except:
-                        # String value was in state.
-                        pass
-                    # assert isinstance(val, int), f'Got non-integer value {val} for state {token} when evaluating {clause}.'
+                    val_stack.append(compile_state_lookup(token))
             token = ''
-            val_stack.append(val)
 
         if c in COMPARISON_SYMBOLS and i != len(clause)-1 and clause[i+1] in COMPARISON_SYMBOLS:
             i += 1
             c += clause[i]
-            # logging.debug(f'Got two-symbol comparator {c}.')
 
         while op_stack and (len(op_stack) == 1 or PRIORITY[c] <= PRIORITY[op_stack[-1]]) and op_stack[-1] != '(':
             operand = op_stack.pop()
             if operand == 'UM':
-                to_negate = val_stack.pop()
-                val_stack.append(-1 * to_negate)
+                val_stack.append(compile_negation(val_stack.pop()))
                 continue
 
-            logging.debug(f'op_stack: {op_stack[-1]}')
             rhs = val_stack.pop()
             lhs = val_stack.pop()
-            logging.debug(f'Calculating "{lhs} {operand} {rhs}".')
-
-            if isinstance(rhs, str):
-                lhs = try_int_conversion(lhs)
-                lhs = str(lhs)
-            elif isinstance(lhs, str):
-                rhs = try_int_conversion(rhs)
-                rhs = str(rhs)
-
-            if operand == '^':
-                value = lhs ** rhs
-            elif operand == '*':
-                value = lhs * rhs
-            elif operand == '/':
-                value = lhs / rhs
-            elif operand == '+':
-                value = lhs + rhs
-            elif operand == '-':
-                value = lhs - rhs
-            elif operand == '||':
-                value = lhs or rhs
-            elif operand == '&&':
-                value = lhs and rhs
-            elif operand == '==':
-                value = lhs == rhs
-            elif operand == '!=':
-                value = lhs != rhs
-            elif operand == '>':
-                value = lhs > rhs
-            elif operand == '<':
-                value = lhs < rhs
-            elif operand == '>=':
-                value = lhs >= rhs
-            elif operand == '<=':
-                value = lhs <= rhs
-            elif operand == 'NOT':
-                value = not value
-            else:
-                raise ValueError(f'Got unrecognized operand {operand} at character {i} while calculating {clause}!')
 
-            logging.debug(f'Calculated "{value}".')
-            val_stack.append(value)
+            if operand not in BINARY_OPERATIONS:
+                raise ValueError(f'Got unrecognized operand {operand} at character {i} while calculating {clause}!')
+            val_stack.append(compile_binary_operation(BINARY_OPERATIONS[operand], lhs, rhs))
 
         if c == ')':
             assert op_stack[-1] == '(', f'Got close parenthesis at character {i} that didn\'t match with open parenthesis in current operand stack {op_stack} while calculating {clause}!'
@@ -168,16 +153,54 @@ def calculate(clause, state):
     assert len(op_stack) == 0, f'Operand stack expected to contain no elements, but was {op_stack} after calculating {clause}!'
     assert len(val_stack) == 1, f'Value stack expected to contain one element, but was {val_stack} after calculating {clause}!'
 
-    result = val_stack.pop()
-    result = try_int_conversion(result)
-
-    try:
-        result = max(0, result)
-    except TypeError:
-        # Is string
-        pass
-    logging.debug(f'Calculated value of {result} for clause {clause}.')
-    return result
+    return compile_result(val_stack.pop())
+
+def compile_constant(value):
+    return lambda state: value
+
+def compile_state_lookup(token):
+    def lookup(state):
+        if token not in state:
+            if set_up_logging.HOT_PATH_LOGGING:
+                logging.info(f'Accessing token {token} that is not present in state {state}! This may be intentional use of the default property, or you may be using a token that is not yet defined. (Did you double check your spelling?)')
+        val = state[token]
+        try:
+            val = float(val)
+        except:
+            # String value was in state.
+            pass
+        # assert isinstance(val, int), f'Got non-integer value {val} for state {token} when evaluating {clause}.'
+        return val
+    return lookup
+
+def compile_negation(operand):
+    return lambda state: -1 * operand(state)
+
+# Both sides are always calculated, even for '||' and '&&', so that every state
+# value the clause uses is read.
+def compile_binary_operation(operation, lhs, rhs):
+    def calculate_operation(state):
+        lhs_value = lhs(state)
+        rhs_value = rhs(state)
+        if isinstance(rhs_value, str):
+            lhs_value = try_int_conversion(lhs_value)
+            lhs_value = str(lhs_value)
+        elif isinstance(lhs_value, str):
+            rhs_value = try_int_conversion(rhs_value)
+            rhs_value = str(rhs_value)
+        return operation(lhs_value, rhs_value)
+    return calculate_operation
+
+def compile_result(value):
+    def calculate_result(state):
+        result = try_int_conversion(value(state))
+        try:
+            result = max(0, result)
+        except TypeError:
+            # Is string
+            pass
+        return result
+    return calculate_result
 
 def try_int_conversion(maybe_num):
     try:
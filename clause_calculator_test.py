@@ -0,0 +1,94 @@
+import collections
+import logging
+import unittest
+from unittest import mock
+
+import clause_calculator
+import set_up_logging
+from nested_choices import NestedChoices
+
+class CalculateTestCase(unittest.TestCase):
+
+    def test_arithmetic(self):
+        state = {'wealth': 10, 'thousand': 1000}
+        self.assertEqual(clause_calculator.calculate('10-(10+thousand*wealth)', state), 0)
+        self.assertEqual(clause_calculator.calculate('1+1*2+(2*(3/3+3))/thousand', state), 3)
+        self.assertEqual(clause_calculator.calculate('(((((((2^5)))))))', state), 32)
+        self.assertEqual(clause_calculator.calculate('wealth/4', state), 2)
+
+    def test_strings(self):
+        self.assertEqual(clause_calculator.calculate('"pretty pretty princesses"', {}), 'pretty pretty princesses')
+        self.assertEqual(clause_calculator.calculate('name', {'name': 'Gabe'}), 'Gabe')
+        self.assertEqual(clause_calculator.calculate('"test" + "test"', {}), 'testtest')
+        self.assertEqual(clause_calculator.calculate('"data: " + data', {'data': 12345}), 'data: 12345')
+
+    def test_comparisons(self):
+        self.assertEqual(clause_calculator.calculate('"12345" == "123" + fourfive', {'fourfive': 45}), 1)
+        self.assertEqual(clause_calculator.calculate('"abhorent" > "bad" && (12 + (dogs * cats) == 12 * 6 && "meemo" == "me" + "moo")', {'dogs': 2, 'cats': 3}), 0)
+        state = {'relationship': 'widowed'}
+        self.assertEqual(clause_calculator.calculate('relationship=="married"||relationship=="widowed"||relationship=="divorced"', state), 1)
+
+    def test_empty(self):
+        self.assertEqual(clause_calculator.calculate('', {}), '')
+
+    def test_compiled_once(self):
+        clause_calculator.compile_clause.cache_clear()
+        for wealth in range(10):
+            self.assertEqual(clause_calculator.calculate('wealth*3', {'wealth': wealth}), wealth * 3)
+        self.assertEqual(clause_calculator.compile_clause.cache_info().misses, 1)
+
+    def test_state_read_on_every_calculation(self):
+        state = collections.defaultdict(int)
+        self.assertEqual(clause_calculator.calculate('b+a||c', state), 0)
+        self.assertEqual(list(state), ['b', 'a', 'c'])
+        state['a'] = 4
+        self.assertEqual(clause_calculator.calculate('b+a||c', state), 4)
+
+    def test_unmatched_close_paren(self):
+        with self.assertRaises(IndexError):
+            clause_calculator.calculate('1)', {})
+
+class HotPathLoggingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root_level = logging.getLogger().level
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self.root_level)
+        set_up_logging.refresh_hot_path_logging()
+
+    def test_off_at_warning(self):
+        logging.getLogger().setLevel(logging.WARNING)
+        self.assertFalse(set_up_logging.refresh_hot_path_logging())
+        with self.assertNoLogs(level='DEBUG'):
+            clause_calculator.calculate('wealth+1', {'wealth': 1})
+
+    def test_follows_logging_level(self):
+        with self.assertLogs(level='DEBUG') as logs:
+            self.assertTrue(set_up_logging.refresh_hot_path_logging())
+            clause_calculator.calculate('wealth+1', {'wealth': 1})
+        self.assertIn('Calculated value of 2', '\n'.join(logs.output))
+
+    # At INFO, the DEBUG messages, which dump whole states, aren't built.
+    def test_debug_off_at_info(self):
+        logging.getLogger().setLevel(logging.INFO)
+        self.assertTrue(set_up_logging.refresh_hot_path_logging())
+        self.assertFalse(set_up_logging.HOT_PATH_DEBUG_LOGGING)
+        # Compiled first, which logs once per clause rather than per use.
+        clause_calculator.calculate('wealth+1', {'wealth': 1})
+        with mock.patch.object(clause_calculator.logging, 'debug') as debug:
+            clause_calculator.calculate('wealth+1', {'wealth': 1})
+        debug.assert_not_called()
+
+    # Generating looks the logging level up again, so configuring logging is
+    # all it takes.
+    def test_generation_follows_logging_level(self):
+        logging.getLogger().setLevel(logging.WARNING)
+        set_up_logging.refresh_hot_path_logging()
+        table = NestedChoices.load_from_string_list('t', ['%wealth:+=1%'])
+        with self.assertLogs(level='DEBUG') as logs:
+            table.gen_choices()
+        self.assertIn('generated_choice', '\n'.join(logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
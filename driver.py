@@ -2,9 +2,11 @@ import logging
 import argparse
 import random
 import re
+import sys
 
 import random_npc
 import random_shops
+import streaming
 from nested_choices import NestedChoices
 
 HELP_TEXT = """This script generates random things. The things you can request are:
@@ -21,17 +23,29 @@ def main():
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--street', action='store_true')
     parser.add_argument('--gen', action='store')
+    parser.add_argument('--compile', action='store', help='Precompile a choices file, so later runs start faster.')
+    parser.add_argument('--num', action='store', type=int, default=1, help='How many independent results to --gen.')
+    parser.add_argument('--seed', action='store', type=int, help='Makes --gen results reproducible.')
+    parser.add_argument('--workers', action='store', type=int, default=1, help='How many processes to --gen with.')
+    parser.add_argument('--jsonl', action='store', help='Stream --gen results to this file as JSON lines, or to stdout if "-".')
     args = parser.parse_args()
-    print(args.gen)
     if args.debug:
         logging_level = logging.DEBUG
     logging.basicConfig(level=logging_level)
 
+    if args.compile:
+        print(compile_table(args.compile))
+        exit()
     if args.street:
         print(load_and_gen('random_street')[0])
         exit()
     if args.gen:
-        print(load_and_gen(args.gen)[0])
+        results = load_and_gen_batch(args.gen, args.num, args.seed, args.workers)
+        if args.jsonl:
+            write_jsonl(results, args.jsonl)
+        else:
+            for generated in results:
+                print(generated)
         exit()
 
     repl()
@@ -92,11 +106,30 @@ def gen_shop(shop_override=None):
 def gen_unique_shop():
     return random_shops.get_unique_shop()
 
+def compile_table(filename):
+    if '.' not in filename:
+        filename = filename + '.txt'
+    return NestedChoices.compile_to_artifact(filename)
+
 def load_and_gen(filename, params={'num':1, 'uniqueness_level':0}):
     if '.' not in filename:
         filename = filename + '.txt'
     choices = NestedChoices.load_from_file(filename)
     return choices.gen_choices(params=params)
 
+def load_and_gen_batch(filename, num, seed=None, workers=1):
+    if '.' not in filename:
+        filename = filename + '.txt'
+    choices = NestedChoices.load_from_file(filename)
+    if workers > 1:
+        return choices.gen_parallel(num, seed=seed, workers=workers, lazy=True)
+    return choices.gen_batch(num, seed=seed, lazy=True)
+
+def write_jsonl(results, filename):
+    if filename == '-':
+        return streaming.write_jsonl(results, sys.stdout)
+    with open(filename, 'w', encoding='utf-8') as output_file:
+        return streaming.write_jsonl(results, output_file)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,111 @@
+import time
+from collections import defaultdict
+
+from nested_choices import iter_choices_tree
+
+class NodeStats():
+
+    def __init__(self):
+        # How many times a choice was made from the node's group while the node
+        # was still available to be picked.
+        self.visits = 0
+        self.picks = 0
+        # Time spent expanding the node and everything under it, only counted
+        # once when the node is nested in itself, through a subtable call. Not
+        # recorded by the iterative engine, which doesn't call expand_choice.
+        self.total_seconds = 0.0
+
+    def __repr__(self):
+        return f'NodeStats(visits={self.visits}, picks={self.picks}, total_seconds={self.total_seconds})'
+
+
+class HeatmapRow():
+
+    def __init__(self, namespace_id, path, line, wc, stats):
+        self.namespace_id = namespace_id
+        # None for tables that weren't loaded from a file.
+        self.path = path
+        self.line = line
+        self.wc = wc
+        self.stats = stats
+
+    @property
+    def location(self):
+        if self.path is None:
+            return self.namespace_id
+        if self.line is None:
+            return self.path
+        return f'{self.path}:{self.line}'
+
+
+# Records how often each WeightedChoice was a candidate, how often it was
+# picked, and how long expanding it took, for finding the branches of a table
+# that dominate generation and the ones that are never reached. Used the same
+# way as profiling.PhaseProfiler, by passing it to profiling.profile.
+class NodeHeatmap():
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # WeightedChoice to NodeStats.
+        self.nodes = defaultdict(NodeStats)
+        # id of each table generated from to the table.
+        self.tables = {}
+        # WeightedChoice to how many times it's being expanded right now.
+        self.open_counts = defaultdict(int)
+
+    # Replaces the generator's choose_for_tag and expand_choice with recording
+    # versions, on the instance only.
+    def instrument(self, generator):
+        self.tables[id(generator.parent)] = generator.parent
+        choose_for_tag = generator.choose_for_tag
+        expand_choice = generator.expand_choice
+
+        def recorded_choose_for_tag(choices_dict, choice_to_expand, tag, excluded=()):
+            for wc in choices_dict.get_group(tag.num).choices:
+                if wc not in generator.used_choices and wc not in excluded:
+                    self.nodes[wc].visits += 1
+            wc = choose_for_tag(choices_dict, choice_to_expand, tag, excluded)
+            self.nodes[wc].picks += 1
+            return wc
+
+        def recorded_expand_choice(choices_dict, wc):
+            self.open_counts[wc] += 1
+            start = self.clock()
+            try:
+                return expand_choice(choices_dict, wc)
+            finally:
+                elapsed = self.clock() - start
+                self.open_counts[wc] -= 1
+                if not self.open_counts[wc]:
+                    self.nodes[wc].total_seconds += elapsed
+
+        generator.choose_for_tag = recorded_choose_for_tag
+        generator.expand_choice = recorded_expand_choice
+
+    # A HeatmapRow for every choice of every table generated from, whether it
+    # was reached or not, the most time consuming first.
+    def report(self):
+        rows = []
+        for table in self.tables.values():
+            for wc in iter_choices_tree(table.choices):
+                stats = self.nodes[wc] if wc in self.nodes else NodeStats()
+                rows.append(HeatmapRow(table.namespace_id, table.source_path, wc.line, wc, stats))
+        return sorted(rows, key=lambda row: (-row.stats.total_seconds, -row.stats.picks))
+
+    # Choices that were never picked. With enough generations, these are the
+    # branches that are unreachable or too unlikely to matter.
+    def dead_choices(self):
+        return [row for row in self.report() if not row.stats.picks]
+
+    def format_report(self, limit=None):
+        rows = self.report()
+        lines = [f'{"location":<40} {"visits":>8} {"picks":>8} {"total ms":>10}  choice']
+        for row in rows[:limit]:
+            stats = row.stats
+            lines.append(f'{row.location:<40} {stats.visits:>8} {stats.picks:>8} {stats.total_seconds * 1000:>10.3f}  {row.wc.choice.strip()}')
+        dead = [row for row in rows if not row.stats.picks]
+        if dead:
+            lines.append(f'\nNever picked ({len(dead)}):')
+            for row in sorted(dead, key=lambda row: (row.path or row.namespace_id, row.line or 0)):
+                lines.append(f'{row.location:<40} {row.wc.choice.strip()}')
+        return '\n'.join(lines)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import heatmap
+import profiling
+from nested_choices import NestedChoices, iter_choices_tree
+
+# Comments and blank lines shift the choices from their lines once comments are
+# stripped, which the heatmap has to account for.
+TABLE = '''weather
+# What the weather is like.
+
+1 sunny $
+  1 and hot
+  # Never picked.
+  0 and cold
+
+# Also never picked.
+0 rainy
+'''
+
+class NodeHeatmapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'weather.txt')
+        with open(self.path, 'w') as table_file:
+            table_file.write(TABLE)
+        self.table = NestedChoices.load_from_file(self.path, cache=None, prefer_compiled=False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def gen_heatmap(self, num):
+        with profiling.profile(heatmap.NodeHeatmap()) as node_heatmap:
+            self.table.gen_batch(num, seed=0)
+        return node_heatmap
+
+    def test_counts_and_lines(self):
+        rows = {row.wc.choice.strip(): row for row in self.gen_heatmap(5).report()}
+        self.assertEqual(rows['sunny $'].line, 4)
+        self.assertEqual(rows['and hot'].line, 5)
+        self.assertEqual(rows['and cold'].line, 7)
+        self.assertEqual(rows['rainy'].line, 10)
+        self.assertEqual((rows['sunny $'].stats.visits, rows['sunny $'].stats.picks), (5, 5))
+        self.assertEqual((rows['rainy'].stats.visits, rows['rainy'].stats.picks), (5, 0))
+        self.assertEqual(rows['and hot'].stats.picks, 5)
+        self.assertGreater(rows['sunny $'].stats.total_seconds, 0)
+
+    # Lines are recorded when the table is loaded, so later edits to the file
+    # don't shift them, and compiled tables keep them.
+    def test_lines_from_loading(self):
+        with open(self.path, 'w') as table_file:
+            table_file.write(TABLE.replace('# What the weather is like.\n', ''))
+        rows = {row.wc.choice.strip(): row for row in self.gen_heatmap(1).report()}
+        self.assertEqual(rows['rainy'].line, 10)
+
+        compiled = NestedChoices.load_compiled(self.path, NestedChoices.compile_to_artifact(self.path))
+        lines = {wc.choice.strip(): wc.line for wc in iter_choices_tree(compiled.choices)}
+        self.assertEqual(lines, {'sunny $': 3, 'and hot': 4, 'and cold': 6, 'rainy': 9})
+
+    def test_dead_choices(self):
+        dead = [row.wc.choice.strip() for row in self.gen_heatmap(5).dead_choices()]
+        self.assertEqual(sorted(dead), ['and cold', 'rainy'])
+
+    def test_subtable_without_source(self):
+        table = NestedChoices.load_from_string_list('street', ['A @widths street'])
+        table.register_subtable(NestedChoices.load_from_string_list('widths', ['wide', 'narrow']))
+        with profiling.profile(heatmap.NodeHeatmap()) as node_heatmap:
+            table.gen_batch(4, seed=0)
+        rows = [row for row in node_heatmap.report() if row.namespace_id == 'widths']
+        self.assertEqual(sum(row.stats.picks for row in rows), 4)
+        self.assertEqual({row.location for row in rows}, {'widths'})
+
+if __name__ == '__main__':
+    unittest.main()
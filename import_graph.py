@@ -0,0 +1,62 @@
+import collections
+import logging
+
+import table_cache
+
+class ImportNode():
+
+    def __init__(self, filename, namespace_id, import_files, choices_string, line_numbers, stamp):
+        self.filename = filename
+        self.path = table_cache.resolve_path(filename)
+        self.namespace_id = namespace_id
+        self.import_files = import_files
+        self.import_paths = [table_cache.resolve_path(f) for f in import_files]
+        self.choices_string = choices_string
+        self.line_numbers = line_numbers
+        self.stamp = stamp
+
+    def __str__(self):
+        return f'{self.namespace_id}({self.filename})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+# Walks every file reachable through imports from filename, reading each file
+# exactly once, no matter how many files import it.
+#
+# read_file: Called with a filename, returns (namespace_id, import_files,
+# choices_string, line_numbers), as nested_choices.read_choices_file does.
+# is_loaded: Called with a resolved path. Files it returns True for are taken to
+# already be available, and neither they nor their imports are read.
+#
+# Returns an OrderedDict of resolved path to ImportNode, in dependency order, so
+# that every file comes after all of the files that it imports. Raises a
+# ValueError if the imports contain a cycle.
+def build_import_graph(filename, read_file, is_loaded=lambda path: False):
+    nodes = collections.OrderedDict()
+    import_chain = []
+
+    def visit(filename):
+        path = table_cache.resolve_path(filename)
+        if path in nodes:
+            return
+        if path in import_chain:
+            cycle = import_chain[import_chain.index(path):] + [path]
+            raise ValueError(f'Found an import cycle while loading {filename}: {" -> ".join(cycle)}')
+        if is_loaded(path):
+            return
+
+        # Stamp before reading, so a write that races with us shows up as stale later.
+        stamp = table_cache.file_stamp(filename)
+        namespace_id, import_files, choices_string, line_numbers = read_file(filename)
+        import_chain.append(path)
+        for import_filename in import_files:
+            visit(import_filename)
+        import_chain.pop()
+
+        logging.debug(f'Adding {namespace_id} ({path}) to the import graph, importing {import_files}.')
+        nodes[path] = ImportNode(filename, namespace_id, import_files, choices_string, line_numbers, stamp)
+
+    visit(filename)
+    return nodes
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import import_graph
+import nested_choices
+from nested_choices import NestedChoices
+
+class ImportGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_table(self, name, data, imports=[]):
+        filename = os.path.join(self.dir, name + '.txt')
+        header = name + '\n' + ''.join(f'{i}:{os.path.join(self.dir, i)}.txt\n' for i in imports)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(header + '\n' + data)
+        return filename
+
+    def write_diamond(self):
+        self.write_table('shops', '1 bakery')
+        self.write_table('street', '1 street with a @shops', imports=['shops'])
+        self.write_table('events', '1 fire at the @shops', imports=['shops'])
+        return self.write_table('town', '1 @street, @events', imports=['street', 'events'])
+
+    def test_dependency_order(self):
+        filename = self.write_diamond()
+        graph = import_graph.build_import_graph(filename, nested_choices.read_choices_file)
+        self.assertEqual([node.namespace_id for node in graph.values()], ['shops', 'street', 'events', 'town'])
+
+    def test_shared_import_read_once(self):
+        filename = self.write_diamond()
+        with mock.patch.object(nested_choices, 'read_choices_file', wraps=nested_choices.read_choices_file) as read:
+            town = NestedChoices.load_from_file(filename, cache=None)
+        self.assertEqual(read.call_count, 4)
+        self.assertIs(town.subtables['street'].subtables['shops'], town.subtables['events'].subtables['shops'])
+        self.assertEqual(town.gen_choices(), ['street with a bakery, fire at the bakery'])
+
+    def test_is_loaded_prunes_subgraph(self):
+        filename = self.write_diamond()
+        street = os.path.realpath(os.path.join(self.dir, 'street.txt'))
+        graph = import_graph.build_import_graph(filename, nested_choices.read_choices_file, lambda path: path == street)
+        self.assertEqual([node.namespace_id for node in graph.values()], ['shops', 'events', 'town'])
+
+    def test_cycle_detected(self):
+        self.write_table('a', '1 @b', imports=['b'])
+        self.write_table('b', '1 @c', imports=['c'])
+        filename = self.write_table('c', '1 @a', imports=['a'])
+        with self.assertRaisesRegex(ValueError, 'import cycle'):
+            NestedChoices.load_from_file(filename, cache=None)
+
+    def test_self_import_detected(self):
+        filename = self.write_table('a', '1 @a', imports=['a'])
+        with self.assertRaisesRegex(ValueError, 'import cycle'):
+            import_graph.build_import_graph(filename, nested_choices.read_choices_file)
+
+if __name__ == '__main__':
+    unittest.main()
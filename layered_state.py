@@ -0,0 +1,170 @@
+import collections.abc
+import itertools
+
+# Stands in for a key that had no value of its own when a change was journaled.
+_MISSING = object()
+
+# Generation state: a dict of state names to values that, like a
+# defaultdict(int), reads names it doesn't have as 0, storing the 0 unless the
+# state has been forked.
+#
+# On top of that, changes can be undone and states can be shared:
+#
+# snapshot and rollback undo every change made since the snapshot, by keeping a
+# journal of the values changes replaced while any snapshot is open, rather
+# than copying the state.
+#
+# fork returns a new state that starts out with everything in this one,
+# without copying it. This state becomes a read-only base that the new state
+# reads through to, and any number of states can be forked from it. Forking a
+# forked state adds another base, so a chain of forks reads through all of
+# them, newest first.
+#
+# The state's own entries are the dict itself, so reading them costs no more
+# than reading a dict. Only names that come from a base go through Python.
+
+class LayeredState(dict):
+
+    # Read-only states this one reads through to, newest first.
+    bases = ()
+    # Every name in the bases, in the order they're iterated. Bases can't
+    # change, so this is worked out once per base and shared by its forks.
+    base_keys = {}
+    # List of (name, the value it had or _MISSING) for each change since the
+    # oldest open snapshot, or None if there are no open snapshots.
+    journal = None
+    open_snapshots = 0
+    frozen = False
+
+    def __missing__(self, key):
+        for base in self.bases:
+            if dict.__contains__(base, key):
+                return dict.__getitem__(base, key)
+        if not self.frozen:
+            self[key] = 0
+        return 0
+
+    def __setitem__(self, key, value):
+        if self.frozen:
+            raise ValueError(f'Can\'t set "{key}" on a state that has been forked, set it on a fork instead.')
+        if self.journal is not None:
+            self.journal.append((key, dict.get(self, key, _MISSING)))
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.base_keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        if self.frozen:
+            raise ValueError('Can\'t update a state that has been forked, update a fork instead.')
+        if self.journal is None:
+            dict.update(self, *args, **kwargs)
+            return
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __iter__(self):
+        if not self.bases:
+            return dict.__iter__(self)
+        return itertools.chain(dict.__iter__(self), (key for key in self.base_keys if not dict.__contains__(self, key)))
+
+    def __len__(self):
+        if not self.bases:
+            return dict.__len__(self)
+        return dict.__len__(self) + len(self.base_keys) - len(dict.keys(self) & self.base_keys.keys())
+
+    def keys(self):
+        if not self.bases:
+            return dict.keys(self)
+        return collections.abc.KeysView(self)
+
+    def items(self):
+        if not self.bases:
+            return dict.items(self)
+        return ItemsView(self)
+
+    def values(self):
+        if not self.bases:
+            return dict.values(self)
+        return collections.abc.ValuesView(self)
+
+    def __eq__(self, other):
+        if not self.bases:
+            return dict.__eq__(self, other)
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Entries can only be added or changed, which keeps forks and the journal
+    # simple, and is all generation does.
+    def _unsupported(self, *args, **kwargs):
+        raise TypeError('State entries can\'t be removed.')
+
+    __delitem__ = pop = popitem = clear = _unsupported
+
+    # Copies and pickles get every entry as their own, without bases or
+    # snapshots.
+    def __reduce__(self):
+        return (LayeredState, (dict(self.items()),))
+
+    def copy(self):
+        return LayeredState(self.items())
+
+    def __repr__(self):
+        return f'LayeredState({dict(self.items())!r})'
+
+    # Returns a token for rollback. Snapshots have to be closed, by rollback or
+    # release, in the reverse of the order they were taken.
+    def snapshot(self):
+        if self.journal is None:
+            self.journal = []
+        self.open_snapshots += 1
+        return len(self.journal)
+
+    # Undoes every change made since snapshot was taken, and closes it.
+    def rollback(self, snapshot):
+        journal = self.journal
+        while len(journal) > snapshot:
+            key, value = journal.pop()
+            if value is _MISSING:
+                dict.__delitem__(self, key)
+            else:
+                dict.__setitem__(self, key, value)
+        self.release(snapshot)
+
+    # Keeps the changes made since snapshot was taken, and closes it. Snapshots
+    # taken before it can still undo them. Nothing is journaled once every
+    # snapshot is closed.
+    def release(self, snapshot):
+        self.open_snapshots -= 1
+        if not self.open_snapshots:
+            self.journal = None
+
+    def fork(self):
+        assert self.journal is None, 'Can\'t fork a state with open snapshots.'
+        if not self.frozen:
+            self.frozen = True
+            self.frozen_keys = dict.fromkeys(itertools.chain(dict.keys(self), self.base_keys))
+        state = LayeredState()
+        if dict.__len__(self):
+            state.bases, state.base_keys = (self,) + self.bases, self.frozen_keys
+        else:
+            state.bases, state.base_keys = self.bases, self.base_keys
+        return state
+
+# The items of a state with bases. Checking for an item mustn't read a missing
+# name, which would store a 0 for it.
+class ItemsView(collections.abc.ItemsView):
+
+    def __contains__(self, item):
+        key, value = item
+        return key in self._mapping and self._mapping[key] == value
@@ -0,0 +1,119 @@
+import copy
+import pickle
+import unittest
+
+from layered_state import LayeredState
+
+class LayeredStateTestCase(unittest.TestCase):
+
+    def test_missing_reads_as_zero(self):
+        state = LayeredState()
+        self.assertEqual(state['wealth'], 0)
+        self.assertIn('wealth', state.keys())
+
+    def test_rollback(self):
+        state = LayeredState({'wealth': 1})
+        snapshot = state.snapshot()
+        state['wealth'] = 2
+        state['dogs'] = 3
+        state.rollback(snapshot)
+        self.assertEqual(state, {'wealth': 1})
+        self.assertIsNone(state.journal)
+
+    def test_nested_snapshots(self):
+        state = LayeredState()
+        outer = state.snapshot()
+        inner = state.snapshot()
+        state['wealth'] = 2
+        state.release(inner)
+        self.assertEqual(state['wealth'], 2)
+        inner = state.snapshot()
+        state['cats'] = 4
+        state.rollback(inner)
+        self.assertEqual(state, {'wealth': 2})
+        state.rollback(outer)
+        self.assertEqual(state, {})
+        self.assertIsNone(state.journal)
+
+    def test_rollback_fork(self):
+        state = LayeredState({'wealth': 1}).fork()
+        snapshot = state.snapshot()
+        state['wealth'] += 1
+        state.update({'dogs': 2})
+        self.assertEqual(state, {'wealth': 2, 'dogs': 2})
+        state.rollback(snapshot)
+        self.assertEqual(state, {'wealth': 1})
+        self.assertEqual(len(state), 1)
+
+    def test_fork_with_open_snapshot(self):
+        state = LayeredState()
+        state.snapshot()
+        with self.assertRaises(AssertionError):
+            state.fork()
+
+    def test_fork(self):
+        base = LayeredState({'wealth': 10, 'name': 'Gabe'})
+        first, second = base.fork(), base.fork()
+        first['wealth'] += 5
+        first['dogs'] += 1
+        self.assertEqual(first, {'wealth': 15, 'name': 'Gabe', 'dogs': 1})
+        self.assertEqual(second, {'wealth': 10, 'name': 'Gabe'})
+        self.assertEqual(base, {'wealth': 10, 'name': 'Gabe'})
+        self.assertEqual(len(first), 3)
+        self.assertEqual(sorted(first.items()), [('dogs', 1), ('name', 'Gabe'), ('wealth', 15)])
+
+    def test_fork_of_fork(self):
+        state = LayeredState({'wealth': 10})
+        forked = state.fork()
+        forked['dogs'] = 1
+        forked = forked.fork()
+        self.assertEqual(len(forked.bases), 2)
+        self.assertEqual(forked, {'wealth': 10, 'dogs': 1})
+        # Forks with nothing of their own don't add a base.
+        self.assertEqual(len(forked.fork().bases), 2)
+
+    def test_forked_state_is_read_only(self):
+        state = LayeredState()
+        state.fork()
+        with self.assertRaises(ValueError):
+            state['wealth'] = 1
+        self.assertEqual(state['wealth'], 0)
+        self.assertNotIn('wealth', state)
+
+    def test_update(self):
+        state = LayeredState({'wealth': 1}).fork()
+        state.update(LayeredState({'wealth': 2, 'dogs': 3}).fork(), cats=4)
+        self.assertEqual(state, {'wealth': 2, 'dogs': 3, 'cats': 4})
+        with self.assertRaises(ValueError):
+            state.fork().bases[0].update(wealth=5)
+
+    def test_views(self):
+        base = LayeredState({'wealth': 10, 'name': 'Gabe'})
+        state = base.fork()
+        state['wealth'] = 15
+        keys, items = state.keys(), state.items()
+        state['dogs'] = 1
+        self.assertIn('name', keys)
+        self.assertNotIn('cats', keys)
+        self.assertEqual(list(keys), ['wealth', 'dogs', 'name'])
+        self.assertIn(('wealth', 15), items)
+        self.assertNotIn(('cats', 0), items)
+        self.assertNotIn('cats', state)
+        self.assertEqual(sorted(state.values(), key=str), [1, 15, 'Gabe'])
+        self.assertEqual(len(state), 3)
+        # Forks share their base's names rather than each copying them.
+        self.assertIs(base.fork().base_keys, state.base_keys)
+
+    def test_copies_are_flat(self):
+        state = LayeredState({'wealth': 1}).fork()
+        state['dogs'] = 2
+        for copied in [pickle.loads(pickle.dumps(state)), copy.copy(state), state.copy()]:
+            self.assertEqual(copied, {'wealth': 1, 'dogs': 2})
+            self.assertEqual(copied.bases, ())
+
+    def test_entries_cant_be_removed(self):
+        with self.assertRaises(TypeError):
+            del LayeredState({'wealth': 1})['wealth']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,50 @@
 import re
-import random
-import uuid
+import os
+import sys
+import functools
+import itertools
 import math
 import logging
 import argparse
 
+import alias_sampler
 import state_clause_handler
+import choice_template
 import choices_util
 import choices_validator
+import import_graph
+import layered_state
+import parallel_generation
+import seeding
+import streaming
 import choice_generator as choice_generator_mod
+import table_cache
+import table_compiler
 from state_regexes import STATE_REGEXES
 
+# Ids for WeightedChoices, unique within the process.
+_choice_ids = itertools.count()
+
+# Tables can have tens of thousands of choices, so they're kept small: no
+# instance __dict__, and a plain int to tell them apart. They compare and hash
+# by identity. Their text and clauses are interned, since the same ones recur
+# across branches and tables.
 class WeightedChoice():
-    def __init__(self, weight, choice, tag_num=1, clause=None):
+    __slots__ = ('weight', 'choice', 'tag_num', 'clause', 'value_modification', 'template', 'id', 'line')
+
+    # line: The line of its file the choice was loaded from, if any.
+    def __init__(self, weight, choice, tag_num=1, clause=None, line=None):
         self.weight = int(weight)
-        self.choice = choice
+        self.choice = sys.intern(choice)
         self.tag_num = tag_num
-        self.clause = clause
-        self.uuid = uuid.uuid4()
+        self.clause = sys.intern(clause) if clause else clause
+        # The clause, parsed, for weighing the choice.
+        self.value_modification = None
+        if clause:
+            self.value_modification = state_clause_handler.parse_value_modification(clause)
+        self.template = choice_template.compile_template(choice)
+        self.id = next(_choice_ids)
+        self.line = line
 
     def __str__(self):
         str_rep = f'({self.weight})[{self.tag_num}]'
@@ -30,12 +57,114 @@ class WeightedChoice():
         return self.__str__()
 
 
+# The weighted choices that can fill one tag of a choice, in file order.
+class TagGroup():
+    __slots__ = ('tag_num', 'choices', 'indices', 'weights', 'total_weight', 'is_static', '_alias_table')
+
+    def __init__(self, tag_num):
+        self.tag_num = tag_num
+        self.choices = []
+        # WeightedChoice to its index in choices.
+        self.indices = {}
+        self.weights = []
+        self.total_weight = 0
+        # Whether all of the weights are fixed, i.e. none have a state clause.
+        self.is_static = True
+        self._alias_table = None
+
+    def add(self, wc):
+        self.indices[wc] = len(self.choices)
+        self.choices.append(wc)
+        self.weights.append(wc.weight)
+        self.total_weight += wc.weight
+        if wc.clause:
+            self.is_static = False
+
+    # Only valid for static groups.
+    @property
+    def alias_table(self):
+        if self._alias_table is None:
+            self._alias_table = alias_sampler.AliasTable(self.weights)
+        return self._alias_table
+
+
+# A node's children in a choices tree: a dict of WeightedChoice to the
+# ChoiceDict of that choice's children. The children are also kept partitioned
+# by tag number, so that filling a tag never has to look at the choices that
+# belong to the node's other tags.
+#
+# Trees are not modified after they're built, so the partition is only made the
+# first time it's used.
+class ChoiceDict(dict):
+    # Every leaf choice has one, so no instance __dict__ on top of the dict.
+    __slots__ = ('_groups',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._groups = None
+
+    # Dict of tag number to TagGroup.
+    @property
+    def groups(self):
+        if self._groups is None:
+            groups = {}
+            for wc in self:
+                if wc.tag_num not in groups:
+                    groups[wc.tag_num] = TagGroup(wc.tag_num)
+                groups[wc.tag_num].add(wc)
+            self._groups = groups
+        return self._groups
+
+    def get_group(self, tag_num):
+        return self.groups.get(tag_num) or EMPTY_GROUP
+
+
+EMPTY_GROUP = TagGroup(None)
+
+
+# Makes a choices tree built from plain dicts, as trees could be before
+# ChoiceDict, into ChoiceDicts. Trees that are already ChoiceDicts are
+# returned as they are.
+def as_choice_dict(choices_tree):
+    if isinstance(choices_tree, ChoiceDict):
+        return choices_tree
+    return ChoiceDict((wc, as_choice_dict(children)) for wc, children in choices_tree.items())
+
+
 class NestedChoices():
 
-    def __init__(self, namespace_id, choices_tree={}):
+    # load_choices: Optional callable returning the choices tree, which is used
+    # in place of choices_tree the first time the choices are needed.
+    def __init__(self, namespace_id, choices_tree=None, load_choices=None):
         self.namespace_id = namespace_id
-        self.choices = choices_tree
+        self._choices = as_choice_dict(choices_tree) if choices_tree is not None else ChoiceDict()
+        self._load_choices = load_choices
         self.subtables = {}
+        self.generator_pool = choice_generator_mod.GeneratorPool(self)
+        # The file this table was compiled from, if any.
+        self.source_path = None
+        # The files this table was compiled from, see table_cache.CacheEntry.
+        self.source_stamps = {}
+
+    @property
+    def choices(self):
+        if self._load_choices is not None:
+            self._choices = self._load_choices()
+            self._load_choices = None
+        return self._choices
+
+    @choices.setter
+    def choices(self, choices_tree):
+        self._choices = as_choice_dict(choices_tree)
+        self._load_choices = None
+
+    # Lazily loaded choices can't be pickled, so they're loaded before sending
+    # the table to another process.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_choices'] = self.choices
+        state['_load_choices'] = None
+        return state
 
     def __str__(self):
         val = '{\n'
@@ -48,50 +177,138 @@ class NestedChoices():
     def __repr__(self):
         return self.__str__()
 
+    # Loads a table and its imports, reusing the compiled form from the process-wide
+    # table cache when none of the source files have changed since it was compiled.
+    # Pass cache=None to always compile from disk.
+    #
+    # The returned object is a copy, so registering subtables on it won't affect
+    # the cached table.
+    #
+    # Unless prefer_compiled is False, a precompiled artifact (see compile_to_artifact)
+    # is loaded instead of the sources whenever it is newer than all of them.
     @staticmethod
-    def load_from_file(filename):
-        with open(filename, 'r', encoding='utf-8') as choices_file:
-            choices_string = choices_file.read()
-
-        # Remove comments
-        choices_string = re.sub('(\n *)? *#.*$', '', choices_string, flags=re.MULTILINE)
-        # print(choices_string)
-
-        # Strip the namespace id off
-        namespace_id = choices_string.split('\n', 1)[0]
-
-        choices_string = choices_string.split('\n', 1)[1]
-
-        import_files = []
-        while ':' in choices_string[:choices_string.index('\n')]:
-            logging.debug(f'Importing from choices_string (trunc): {choices_string[:50]}')
-            required_module = choices_string.split('\n', 1)[0]
-            module_filename = required_module.split(':')[1]
-            #Strip the import off.
-            choices_string = choices_string.split('\n', 1)[1]
-            import_files.append(module_filename)
-
-        # Strip off the leading newline.
-        choices_string = choices_string.split('\n', 1)[1]
-
-        choices_validator.validate_choices(namespace_id, choices_string)
-        choices_tree = NestedChoices.choices_string_to_tree(choices_string)
-
-        resulting_nested_choices = NestedChoices(namespace_id, choices_tree)
-
-        for filename in import_files:
-            imported_choice = NestedChoices.load_from_file(filename)
-            resulting_nested_choices.register_subtable(imported_choice)
-
-        return resulting_nested_choices
-
+    def load_from_file(filename, cache=table_cache.TABLE_CACHE, prefer_compiled=True):
+        if cache is None:
+            return NestedChoices.compile_file(filename, None, prefer_compiled)
+        compiled = cache.get(filename, lambda f: NestedChoices.compile_file(f, cache, prefer_compiled))
+        return compiled.copy()
+
+    # Compiles a table and everything it imports. The import graph is read up front,
+    # so each file is parsed once per load and the resulting subtables are shared
+    # by every table that imports them. Imports that are fresh in the cache aren't
+    # read at all.
+    @staticmethod
+    def compile_file(filename, cache=table_cache.TABLE_CACHE, prefer_compiled=True):
+        if prefer_compiled:
+            compiled = NestedChoices.load_compiled(filename)
+            if compiled is not None:
+                return compiled
+
+        loaded = {}
+
+        def is_loaded(path):
+            if cache is None:
+                return False
+            cached = cache.lookup(path)
+            if cached is not None:
+                loaded[path] = cached
+            return cached is not None
+
+        graph = import_graph.build_import_graph(filename, read_choices_file, is_loaded)
+        root_path = table_cache.resolve_path(filename)
+
+        for path, node in graph.items():
+            choices_validator.validate_choices(node.namespace_id, node.choices_string)
+            choices_tree = NestedChoices.choices_string_to_tree(node.choices_string, node.line_numbers)
+
+            nested_choices = NestedChoices(node.namespace_id, choices_tree)
+            nested_choices.source_path = path
+            stamps = {path: node.stamp}
+            for import_path in node.import_paths:
+                imported_choice = loaded[import_path]
+                nested_choices.register_subtable(imported_choice)
+                stamps.update(imported_choice.source_stamps)
+            nested_choices.source_stamps = stamps
+
+            loaded[path] = nested_choices
+            # The root is stored by whoever asked for it to be compiled.
+            if cache is not None and path != root_path:
+                cache.put(path, nested_choices, stamps)
+
+        return loaded[root_path]
+
+    # Validates and compiles a file and everything it imports into a binary artifact
+    # next to it, which load_from_file will prefer until a source file is modified.
+    # Returns the artifact's filename.
+    @staticmethod
+    def compile_to_artifact(filename, artifact_filename=None):
+        if artifact_filename is None:
+            artifact_filename = table_compiler.artifact_path(filename)
+        nested_choices = NestedChoices.load_from_file(filename, cache=None, prefer_compiled=False)
+
+        # Tables in dependency order, so each one's imports can be linked as it's loaded.
+        tables = []
+        def add_table(table):
+            if any(table.source_path == path for path, _, _, _ in tables):
+                return
+            for subtable in table.subtables.values():
+                add_table(subtable)
+            import_paths = [subtable.source_path for subtable in table.subtables.values()]
+            tables.append((table.source_path, table.namespace_id, import_paths, table.choices))
+        add_table(nested_choices)
+
+        table_compiler.write_artifact(artifact_filename, tables, nested_choices.source_stamps)
+        return artifact_filename
+
+    # Loads a file from its precompiled artifact, if there is one that's up to date.
+    # Trees are decoded lazily, the first time each table's choices are used.
     @staticmethod
-    def choices_string_to_tree(choices_string):
-        choices_tree = {}
+    def load_compiled(filename, artifact_filename=None):
+        if artifact_filename is None:
+            artifact_filename = table_compiler.artifact_path(filename)
+        if not os.path.exists(artifact_filename):
+            return None
+        try:
+            sources, tables = table_compiler.open_artifact(artifact_filename)
+        except (ValueError, EOFError, TypeError) as e:
+            logging.warning(f'Ignoring unreadable compiled table {artifact_filename}: {e}')
+            return None
+        current_stamps = table_compiler.check_sources(artifact_filename, sources)
+        if current_stamps is None:
+            logging.info(f'Compiled table {artifact_filename} is older than its sources, loading from the sources instead.')
+            return None
+
+        loaded = {}
+        for table in tables:
+            nested_choices = NestedChoices(table.namespace_id, load_choices=functools.partial(table.load_choices, WeightedChoice, ChoiceDict))
+            nested_choices.source_path = table.path
+            stamps = {table.path: current_stamps[table.path]}
+            for import_path in table.import_paths:
+                nested_choices.register_subtable(loaded[import_path])
+                stamps.update(loaded[import_path].source_stamps)
+            nested_choices.source_stamps = stamps
+            loaded[table.path] = nested_choices
+
+        root = loaded.get(table_cache.resolve_path(filename))
+        if root is None:
+            logging.warning(f'Compiled table {artifact_filename} does not contain {filename}, loading from the sources instead.')
+        return root
+
+    # line_numbers: The line number in its file of each line of choices_string,
+    # which each choice records as its line. Otherwise choices have no line.
+    @staticmethod
+    def choices_string_to_tree(choices_string, line_numbers=None):
+        choices_tree = ChoiceDict()
+
+        # Index in choices_string's lines of the first line of each block.
+        block_start = 0
+        for top_level_choice_data in choices_string.split('\n\n'):
+            next_block_start = block_start + top_level_choice_data.count('\n') + 2
+            stripped = top_level_choice_data.strip()
+            line_index = block_start + top_level_choice_data[:len(top_level_choice_data) - len(top_level_choice_data.lstrip())].count('\n')
+            block_start = next_block_start
+            top_level_choice_data = stripped
 
-        top_level_choices_list = choices_string.split('\n\n')
-        top_level_choices_list = [choice.strip() for choice in top_level_choices_list]
-        for top_level_choice_data in top_level_choices_list:
             indent = 0
             parent_choicedict_stack = [choices_tree]
             tag_stack = [1]
@@ -100,13 +317,16 @@ class NestedChoices():
             top_level_choice = nested_choices.pop(0)
 
             parent = load_choice_from_line(top_level_choice, tag_stack)
+            if line_numbers is not None:
+                parent.line = line_numbers[line_index]
 
-            choices_tree[parent] = {}
+            choices_tree[parent] = ChoiceDict()
             current_dict = choices_tree[parent]
             # Holds the value to go back to if the next node turns out to be a leaf.
             prev_dict = choices_tree
 
             for choice in nested_choices:
+                line_index += 1
                 # Check how many spaces there are to find the indent level.
                 new_indent = len(choice) - len(choice.lstrip(' '))
 
@@ -134,8 +354,10 @@ class NestedChoices():
 
                 choice = choice[new_indent:]
                 weighted_choice = load_choice_from_line(choice, tag_stack)
+                if line_numbers is not None:
+                    weighted_choice.line = line_numbers[line_index]
 
-                current_dict[weighted_choice] = {}
+                current_dict[weighted_choice] = ChoiceDict()
                 current_dict = current_dict[weighted_choice]
 
 
@@ -154,6 +376,15 @@ class NestedChoices():
 
         return NestedChoices(namespace_id, choices_tree)
 
+    # A shallow copy, sharing the choices tree and subtables, but with its own
+    # subtable registrations.
+    def copy(self):
+        nested_choices = NestedChoices(self.namespace_id, self.choices)
+        nested_choices.subtables = dict(self.subtables)
+        nested_choices.source_path = self.source_path
+        nested_choices.source_stamps = self.source_stamps
+        return nested_choices
+
     def register_subtable(self, nc):
         self.subtables[nc.namespace_id] = nc
 
@@ -174,31 +405,138 @@ class NestedChoices():
     # '$ a $' would be allowed to generate '1 a 2' and '1 a 3' under 'all', but
     # under 'each' that would not be allowed, since the first value repeated itself.
     # Not yet implemented.
-    def gen_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}):
-        return self._gen_choices(params)[0]
+    #
+    # 'engine' can be 'recursive', the default, or 'iterative', see
+    # choice_generator.ENGINES. Both generate the same choices, but only
+    # 'iterative' can generate from tables nested deeper than Python's recursion
+    # limit. Subtable calls use the same engine.
+    #
+    # rng: A seed or random.Random to draw from, see seeding.make_rng. The same
+    # seed and params always give the same results.
+    def gen_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}, rng=None):
+        return self._gen_choices(params, rng)[0]
 
     # The same as gen_choices, but it has extra state data for internal use.
-    def _gen_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}):
+    def _gen_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}, rng=None):
         generated_choices = []
         # used_choices = []
         # state = {}
-        choice_generator = choice_generator_mod.ChoiceGenerator(self)
-
-        for i in range(params['num']):
-            # generated = False
-            # generated_choice = '$'
-            # dict_and_choice_backtrace = []
-            # level = 1
-            choices_dict = self.choices
-
-            generated_choice, state = choice_generator.gen_choice(choices_dict, params)
+        for generated_choice, state in self._iter_choices(params, rng):
             generated_choices.append(generated_choice)
 
         return generated_choices, state
 
-    def call_subtable(self, subtable_id, params):
-        return self.subtables[subtable_id]._gen_choices(params)
+    # The same as gen_choices, but yields each choice as soon as it's generated
+    # instead of holding them all, for very large 'num's. See streaming for
+    # writing the results out as they come.
+    def iter_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}, rng=None):
+        for generated_choice, _ in self._iter_choices(params, rng):
+            yield generated_choice
 
+    # The same as iter_choices, as an async iterator.
+    def aiter_choices(self, params={'num': 1, 'uniqueness_level': 0, 'uniqueness_mode':'each'}, rng=None):
+        return streaming.aiter_results(self.iter_choices(params, rng))
+
+    def _iter_choices(self, params, rng):
+        choice_generator = self.generator_pool.acquire(rng)
+        try:
+            for i in range(params['num']):
+                # generated = False
+                # generated_choice = '$'
+                # dict_and_choice_backtrace = []
+                # level = 1
+                choices_dict = self.choices
+
+                yield choice_generator.gen_choice(choices_dict, params)
+        finally:
+            # reset gives the generator a new state when it's next used, so the
+            # state yielded here is left as it is.
+            self.generator_pool.release(choice_generator)
+
+    # Generates n independent results, sharing one generator across the whole
+    # batch rather than paying for setup on each call.
+    #
+    # seed: If given, item i is generated from seeding.derive_seed(seed, i), so
+    # any item can be reproduced on its own.
+    # independent_state: If True, state and uniqueness are reset between items.
+    # Otherwise they carry over, as they do in gen_choices with 'num' > 1.
+    # params: As in gen_choices, except that 'num' is ignored.
+    # lazy: Returns a generator instead of a list.
+    # start: The index of the first item, for generating part of a larger batch.
+    # initial_state: A dict of state every item starts from, as if an earlier
+    # generation had set it. It's copied once, and each item starts from a
+    # fork of the copy, so it costs the same however many items there are.
+    def gen_batch(self, n, seed=None, independent_state=True, params=None, lazy=False, start=0, initial_state=None):
+        batch = self.iter_batch(n, seed, independent_state, params, start, initial_state)
+        if lazy:
+            return batch
+        return list(batch)
+
+    def iter_batch(self, n, seed=None, independent_state=True, params=None, start=0, initial_state=None):
+        params = dict(params or {'uniqueness_level': 0, 'uniqueness_mode':'each'}, num=1)
+        if initial_state is not None:
+            initial_state = layered_state.LayeredState(initial_state)
+        choice_generator = choice_generator_mod.ChoiceGenerator(self)
+        choices_dict = self.choices
+
+        for i in range(start, start + n):
+            if independent_state or i == start:
+                choice_generator.reset(initial_state)
+            if seed is not None:
+                choice_generator.rng = seeding.GeneratorRandom(seeding.derive_seed(seed, i))
+            generated_choice, _ = choice_generator.gen_choice(choices_dict, params)
+            yield generated_choice
+
+    # The same as gen_batch with independent state, but spread across worker
+    # processes. See parallel_generation.gen_parallel.
+    def gen_parallel(self, n, seed=None, params=None, workers=None, chunk_size=None, lazy=False):
+        results = parallel_generation.gen_parallel(self, n, seed, params, workers, chunk_size)
+        if lazy:
+            return results
+        return list(results)
+
+    def call_subtable(self, subtable_id, params, rng=None):
+        return self.subtables[subtable_id]._gen_choices(params, rng)
+
+
+# Reads a choices file, returning its namespace id, the files it imports, its
+# data lines, with comments removed, and the line number in the file of each of
+# the data lines, counting from 1.
+def read_choices_file(filename):
+    lines = read_choices_lines(filename)
+    namespace_id = lines[0][1]
+
+    import_files = []
+    start = 1
+    while ':' in lines[start][1]:
+        logging.debug(f'Importing from line {lines[start][0]}: {lines[start][1]}')
+        import_files.append(lines[start][1].split(':')[1])
+        start += 1
+
+    # Skip the blank line after the imports.
+    lines = lines[start + 1:]
+    return namespace_id, import_files, '\n'.join(line for _, line in lines), [number for number, _ in lines]
+
+# Every line of a choices file with its line number, with comments removed:
+# lines that are only a comment go entirely, apart from the first.
+def read_choices_lines(filename):
+    with open(filename, 'r', encoding='utf-8') as choices_file:
+        raw_lines = choices_file.read().split('\n')
+
+    lines = []
+    for i, line in enumerate(raw_lines):
+        if i > 0 and re.fullmatch(' *#.*', line):
+            continue
+        comment_start = line.find('#')
+        if comment_start != -1:
+            line = line[:comment_start].rstrip(' ')
+        lines.append((i + 1, line))
+    return lines
+
+def iter_choices_tree(choices_tree):
+    for wc, children in choices_tree.items():
+        yield wc
+        yield from iter_choices_tree(children)
 
 def load_choice_from_line(line, tag_stack):
     try:
@@ -0,0 +1,161 @@
+import glob
+import random
+import unittest
+from unittest import mock
+
+import choice_generator
+import profiling
+from nested_choices import ChoiceDict, NestedChoices, WeightedChoice, iter_choices_tree, read_choices_file, read_choices_lines
+
+def load_counter_table():
+    # Each result reports how many times the table has been generated from with
+    # the same state, so shared state is visible in the output.
+    return NestedChoices.load_from_string_list('counter', ['seen{ %count%} %count:+=1%'])
+
+def load_colors_table():
+    return NestedChoices.load_from_string_list('colors', [f'color {i}' for i in range(50)])
+
+class GenBatchTestCase(unittest.TestCase):
+
+    def test_seeded_batch_is_reproducible(self):
+        colors = load_colors_table()
+        self.assertEqual(colors.gen_batch(20, seed=7), colors.gen_batch(20, seed=7))
+        self.assertNotEqual(colors.gen_batch(20, seed=7), colors.gen_batch(20, seed=8))
+
+    def test_items_independent_of_batch_size(self):
+        colors = load_colors_table()
+        self.assertEqual(colors.gen_batch(5, seed=3), colors.gen_batch(20, seed=3)[:5])
+
+    def test_independent_state(self):
+        counter = load_counter_table()
+        self.assertEqual(counter.gen_batch(3), ['seen', 'seen', 'seen'])
+
+    def test_shared_state(self):
+        counter = load_counter_table()
+        self.assertEqual(counter.gen_batch(3, independent_state=False), ['seen', 'seen 1', 'seen 2'])
+
+    def test_initial_state(self):
+        counter = load_counter_table()
+        initial_state = {'count': 5}
+        self.assertEqual(counter.gen_batch(3, initial_state=initial_state), ['seen 5', 'seen 5', 'seen 5'])
+        self.assertEqual(counter.gen_batch(3, independent_state=False, initial_state=initial_state), ['seen 5', 'seen 6', 'seen 7'])
+        self.assertEqual(initial_state, {'count': 5})
+
+    def test_uniqueness_is_per_item(self):
+        colors = NestedChoices.load_from_string_list('colors', ['red', 'blue'])
+        self.assertEqual(len(colors.gen_batch(10, params={'uniqueness_level': -1})), 10)
+
+    def test_lazy(self):
+        batch = load_colors_table().gen_batch(3, lazy=True)
+        self.assertEqual(len(list(batch)), 3)
+
+class RngTestCase(unittest.TestCase):
+
+    def test_seeded_generation_is_reproducible(self):
+        colors = load_colors_table()
+        params = {'num': 10, 'uniqueness_level': 0}
+        self.assertEqual(colors.gen_choices(params, rng=5), colors.gen_choices(params, rng=5))
+        self.assertNotEqual(colors.gen_choices(params, rng=5), colors.gen_choices(params, rng=6))
+
+    def test_global_random_is_untouched(self):
+        random.seed(1)
+        expected = random.random()
+        random.seed(1)
+        load_colors_table().gen_choices({'num': 10, 'uniqueness_level': 0}, rng=5)
+        self.assertEqual(random.random(), expected)
+
+    def test_subtable_draws_dont_shift_caller(self):
+        # The subtable gets its own split off generator, so how many draws it
+        # makes doesn't change what the caller picks afterwards.
+        results = []
+        for subtable_size in [1, 30]:
+            table = NestedChoices.load_from_string_list('table', ['@sub[3,0]{ @2sub}{ @3sub} then @colors'])
+            table.register_subtable(load_colors_table())
+            table.register_subtable(NestedChoices.load_from_string_list('sub', [f'sub {i}' for i in range(subtable_size)]))
+            results.append(table.gen_choices(rng=9)[0].split(' then ')[1])
+        self.assertEqual(results[0], results[1])
+
+class GeneratorPoolTestCase(unittest.TestCase):
+
+    def test_subtable_calls_reuse_generators(self):
+        table = NestedChoices.load_from_string_list('table', ['@counter and @counter'])
+        table.register_subtable(load_counter_table())
+        with mock.patch.object(choice_generator, 'ChoiceGenerator', wraps=choice_generator.ChoiceGenerator) as constructor:
+            # Every call starts from fresh state, however many times its
+            # generator has been used before.
+            self.assertEqual(table.gen_choices({'num': 5, 'uniqueness_level': 0}, rng=1), ['seen and seen'] * 5)
+        self.assertEqual(constructor.call_count, 2)
+
+    def test_generators_not_shared(self):
+        pool = load_colors_table().generator_pool
+        generator = pool.acquire()
+        self.assertIsNot(pool.acquire(), generator)
+        pool.release(generator)
+        self.assertIs(pool.acquire(), generator)
+
+    def test_idle_taken_by_another_thread(self):
+        pool = load_colors_table().generator_pool
+        generator = pool.acquire()
+        pool.release(generator)
+
+        # Another thread takes the last idle generator between the pool seeing
+        # it and taking it.
+        class RacedList(list):
+            def pop(self):
+                self.clear()
+                return list.pop(self)
+
+        pool.idle = RacedList(pool.idle)
+        self.assertIsNot(pool.acquire(), generator)
+
+    def test_profiler_change(self):
+        pool = load_colors_table().generator_pool
+        pool.release(pool.acquire())
+        with profiling.profile() as profiler:
+            self.assertIs(pool.acquire().profiler, profiler)
+
+class PlainDictTreeTestCase(unittest.TestCase):
+
+    def test_plain_dicts(self):
+        nested_choices = NestedChoices('x', {WeightedChoice(1, 'a $'): {WeightedChoice(1, 'b'): {}}})
+        self.assertIsInstance(next(iter(nested_choices.choices.values())), ChoiceDict)
+        self.assertEqual(nested_choices.gen_choices(), ['a b'])
+        nested_choices.choices = {WeightedChoice(1, 'c'): {}}
+        self.assertEqual(nested_choices.gen_choices(), ['c'])
+
+    def test_choice_dicts_kept(self):
+        choices_tree = ChoiceDict({WeightedChoice(1, 'a'): ChoiceDict()})
+        self.assertIs(NestedChoices('x', choices_tree).choices, choices_tree)
+
+class ReadChoicesLinesTestCase(unittest.TestCase):
+
+    def test_line_numbers(self):
+        for filename in glob.glob('*.txt'):
+            with self.subTest(filename=filename):
+                _, _, choices_string, line_numbers = read_choices_file(filename)
+                raw_lines = [line for _, line in read_choices_lines(filename)]
+                with open(filename, encoding='utf-8') as f:
+                    file_lines = f.read().split('\n')
+                self.assertEqual(len(line_numbers), len(choices_string.split('\n')))
+                for line, number in zip(choices_string.split('\n'), line_numbers):
+                    self.assertTrue(file_lines[number - 1].startswith(line), f'{filename}:{number}')
+
+    def test_choices_record_lines(self):
+        choices_string = '1 $\n  1 a\n  $\n  1 b\n\n\n1 c'
+        choices_tree = NestedChoices.choices_string_to_tree(choices_string, [3, 4, 6, 7, 8, 10, 11])
+        lines = {wc.choice: wc.line for wc in iter_choices_tree(choices_tree)}
+        self.assertEqual(lines, {'$': 3, 'a': 4, 'b': 7, 'c': 11})
+        self.assertIsNone(next(iter(NestedChoices.choices_string_to_tree(choices_string))).line)
+
+class GenParallelTestCase(unittest.TestCase):
+
+    def test_matches_seeded_batch(self):
+        colors = load_colors_table()
+        self.assertEqual(colors.gen_parallel(25, seed=11, workers=2, chunk_size=4), colors.gen_batch(25, seed=11))
+
+    def test_unseeded_workers_differ(self):
+        colors = load_colors_table()
+        self.assertGreater(len(set(colors.gen_parallel(40, workers=2, chunk_size=20))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
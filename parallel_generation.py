@@ -0,0 +1,54 @@
+import collections
+import concurrent.futures
+import itertools
+import logging
+import math
+import os
+import random
+
+# Items per task, when not given. Big enough to amortize the round trip to the
+# worker, small enough to spread the work evenly.
+MAX_CHUNK_SIZE = 1000
+# Chunks queued up for each worker, so it never sits idle waiting for the next.
+MAX_PENDING_PER_WORKER = 2
+
+# The table being generated from, set once in each worker by init_worker.
+worker_choices = None
+
+def init_worker(nested_choices):
+    global worker_choices
+    worker_choices = nested_choices
+
+def gen_chunk(start, count, seed, params):
+    return worker_choices.gen_batch(count, seed=seed, params=params, start=start)
+
+# Generates n independent results from nested_choices across a pool of worker
+# processes, yielding them in order. The table is sent to each worker once, when
+# it starts, rather than with every task.
+#
+# Item i is seeded the same way as in NestedChoices.gen_batch, so a seeded run
+# gives the same results as gen_batch with that seed, whatever the number of
+# workers or chunk size. Without a seed, a random master seed is picked, since
+# forked workers would otherwise all share the parent's random state.
+def gen_parallel(nested_choices, n, seed=None, params=None, workers=None, chunk_size=None):
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(MAX_CHUNK_SIZE, math.ceil(n / (workers * 4))))
+    logging.info(f'Generating {n} results from {nested_choices.namespace_id} on {workers} workers, {chunk_size} at a time.')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(nested_choices,)) as executor:
+        # Only a few chunks per worker are in flight at once, so results that
+        # haven't been consumed yet don't pile up on very large runs.
+        starts = iter(range(0, n, chunk_size))
+        chunks = collections.deque()
+        for start in itertools.islice(starts, workers * MAX_PENDING_PER_WORKER):
+            chunks.append(executor.submit(gen_chunk, start, min(chunk_size, n - start), seed, params))
+        while chunks:
+            results = chunks.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                chunks.append(executor.submit(gen_chunk, start, min(chunk_size, n - start), seed, params))
+            yield from results
@@ -6,8 +6,10 @@ from collections import defaultdict
 FINAL_STATE = "FINAL"
 START_STATE = "START"
 
+# Matching logs each step at DEBUG level. The messages cost far more to build
+# than the matching itself, so whether the logger takes them is checked once
+# per match, rather than building them for logging to drop.
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 CHARACTER_CATEGORIES = {
     'CHAR': {'CHAR contains literally everything, this is handled specially'},
@@ -153,7 +155,8 @@ class StateMachine():
         return self._accepts(string, start=start, partial_match=True)
 
     def reset(self):
-        logger.debug('Resetting machine {self}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Resetting machine {self}')
         self.alternatives_map = {} # {start:int:  [(state: string, start:int, path: list: StateRecord)]
         self.used_state_pos_map = defaultdict(set) # {start: set: (state, str_pos)}.
 
@@ -163,7 +166,9 @@ class StateMachine():
     # TODO: Decide if this should to a more strict DFS, to obviate the need to copy the path all over.
     # Returns (found_bool, path_state_record, end_pos)
     def _accepts(self, string, start=0, partial_match=False):
-        self.debug(f'Checking if state machine {self.id} accepts "{string}", starting at char {start} ({string[start:]})". ({"Partial match" if partial_match else "Full match"})')
+        debug_logging = logger.isEnabledFor(logging.DEBUG)
+        if debug_logging:
+            self.debug(f'Checking if state machine {self.id} accepts "{string}", starting at char {start} ({string[start:]})". ({"Partial match" if partial_match else "Full match"})')
 
         if start in self.alternatives_map.keys():
             alternatives = self.alternatives_map[start]
@@ -172,14 +177,17 @@ class StateMachine():
             self.alternatives_map[start] = alternatives
 
         used_state_pos = self.used_state_pos_map[start]
-        self.debug(f'used_state_pos: {used_state_pos}')
+        if debug_logging:
+            self.debug(f'used_state_pos: {used_state_pos}')
 
         while True:
-            self.debug(f'alternatives: {[alt[0:2] for alt in alternatives]}')
+            if debug_logging:
+                self.debug(f'alternatives: {[alt[0:2] for alt in alternatives]}')
 
             # Alternatives list is empty, nothing else to check!
             if len(alternatives) == 0:
-                self.debug(f'Finished search, no accepting path found.')
+                if debug_logging:
+                    self.debug(f'Finished search, no accepting path found.')
                 return False, None, -1
 
             # Grab an alternative to investigate.
@@ -205,7 +213,8 @@ class StateMachine():
                 assert state_id in self.nested_automata.keys(), f'Got state_id {state_id} that was not in nested_automata list {self.nested_automata.keys()}!'
                 # Note that the automata can be called multiple times. Different starting locations are treated
                 # entirely indepentently.
-                self.debug(f'State {state_id} is an automata, calling it with start={i}')
+                if debug_logging:
+                    self.debug(f'State {state_id} is an automata, calling it with start={i}')
                 accepted, nested_path, match_end = self.nested_automata[state_id].accepts_partial(string, start=i)
                 # nested_path = self.nested_automata[state_id].get_path(i)
                 prev_path.append(StateRecord(self.id, state_id + '_internal', i, match_end, nested_path))
@@ -225,28 +234,35 @@ class StateMachine():
                 path = list(prev_path)
                 input_length = edge.get_input_length()
                 match_end = i + input_length
-                self.debug(f'Evaluating edge: {edge}')
+                if debug_logging:
+                    self.debug(f'Evaluating edge: {edge}')
 
                 if string_matches_edge_input(string, i, edge):
-                    self.debug(f'Matched: "{string[i:match_end]}" at position {i} in "{string}"')
+                    if debug_logging:
+                        self.debug(f'Matched: "{string[i:match_end]}" at position {i} in "{string}"')
 
                     path_step = StateRecord(self.id, state_id, i, match_end)
-                    self.debug(f'Appending path step {path_step} to path {path}.')
+                    if debug_logging:
+                        self.debug(f'Appending path step {path_step} to path {path}.')
                     path.append(path_step)
 
                     destination_state_id = edge.dest
                     if (destination_state_id, match_end) not in used_state_pos:
                         state_pos_path_tuple = (destination_state_id, match_end, path)
-                        self.debug(f'Appending {state_pos_path_tuple} (equivalent to {(edge.dest, string[i+input_length:])}) to alternatives {alternatives}.')
+                        if debug_logging:
+                            self.debug(f'Appending {state_pos_path_tuple} (equivalent to {(edge.dest, string[i+input_length:])}) to alternatives {alternatives}.')
                         assert state_pos_path_tuple[0] in self.state_map.keys(), f'Attempted to append state_pos_path_tuple {state_pos_path_tuple} whose state was not in the state map {self.state_map.keys()} to alternatives list {alternatives}!'
                         alternatives.append(state_pos_path_tuple)
                     else:
-                        self.debug(f'Edge/position pair was already used, skipping.')
+                        if debug_logging:
+                            self.debug(f'Edge/position pair was already used, skipping.')
                 else:
-                    self.debug(f'Edge did not match!')
+                    if debug_logging:
+                        self.debug(f'Edge did not match!')
 
             if state_id == FINAL_STATE and (partial_match or i == len(string)):
-                self.debug(f'Found an accepting path up to char {i}: {prev_path}')
+                if debug_logging:
+                    self.debug(f'Found an accepting path up to char {i}: {prev_path}')
                 return True, prev_path, i
                 break
         return False, None, -1
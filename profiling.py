@@ -0,0 +1,144 @@
+import contextlib
+import re
+import time
+from collections import defaultdict
+
+# The ChoiceGenerator methods timed as phases of their own.
+PROFILED_PHASES = [
+    'choose_for_tag',
+    'pick_choice',
+    'pick_remaining_choice',
+    'mark_used',
+    'remove_childless_parents',
+    'make_replacements',
+    'replace_ranges',
+    'replace_state_interpolation',
+    'make_subtable_calls',
+    'extract_state',
+]
+# How much of a choice's text to name its node after.
+NODE_LABEL_LENGTH = 40
+
+# The profiler new ChoiceGenerators use, set by profile.
+_active_profiler = None
+
+def active_profiler():
+    return _active_profiler
+
+# Every ChoiceGenerator made inside the block, including the ones subtable calls
+# make, reports to profiler, or a new PhaseProfiler if none is given. profiler
+# can be anything with an instrument(generator) method, such as a
+# heatmap.NodeHeatmap. Not thread safe: generators on other threads report to it
+# too.
+@contextlib.contextmanager
+def profile(profiler=None):
+    global _active_profiler
+    if profiler is None:
+        profiler = PhaseProfiler()
+    previous = _active_profiler
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = previous
+
+def table_frame(namespace_id):
+    return f'table:{namespace_id}'
+
+# Collapsed stack files separate frames with ';' and end with a space and the
+# count, so a frame name can't hold a ';' and is kept to one line.
+def node_frame(wc):
+    label = re.sub(r'\s+', ' ', wc.choice.replace(';', ',')).strip()
+    if len(label) > NODE_LABEL_LENGTH:
+        label = label[:NODE_LABEL_LENGTH - 3] + '...'
+    return f'node:{label}'
+
+
+class PhaseStats():
+
+    def __init__(self):
+        self.calls = 0
+        # Including time spent in nested phases, but only counted once when a
+        # phase is nested in itself, as nodes are.
+        self.total_seconds = 0.0
+        self.self_seconds = 0.0
+
+    def __repr__(self):
+        return f'PhaseStats(calls={self.calls}, total_seconds={self.total_seconds}, self_seconds={self.self_seconds})'
+
+
+# Accumulates wall time and call counts for each phase of generation, and for
+# each table and node generated from, keeping the stack each was called from.
+class PhaseProfiler():
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # Names of the frames currently open, outermost first.
+        self.stack = []
+        # For each open frame, [start time, time spent in frames nested in it].
+        self.timings = []
+        # Stack of frame names to the time spent in the innermost frame itself.
+        self.stack_seconds = defaultdict(float)
+        # Frame name to PhaseStats.
+        self.phases = defaultdict(PhaseStats)
+        # Frame name to how many times it's open on the stack.
+        self.open_counts = defaultdict(int)
+
+    def enter(self, name):
+        self.stack.append(name)
+        self.timings.append([self.clock(), 0.0])
+        self.open_counts[name] += 1
+
+    def exit(self):
+        now = self.clock()
+        start, nested_seconds = self.timings.pop()
+        elapsed = now - start
+        self_seconds = elapsed - nested_seconds
+        self.stack_seconds[tuple(self.stack)] += self_seconds
+
+        name = self.stack.pop()
+        self.open_counts[name] -= 1
+        stats = self.phases[name]
+        stats.calls += 1
+        stats.self_seconds += self_seconds
+        if not self.open_counts[name]:
+            stats.total_seconds += elapsed
+        if self.timings:
+            self.timings[-1][1] += elapsed
+
+    def _wrap(self, method, frame_name):
+        def profiled(*args, **kwargs):
+            self.enter(frame_name(*args) if callable(frame_name) else frame_name)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.exit()
+        return profiled
+
+    # Replaces the generator's phases with timed versions, on the instance only,
+    # so generators that aren't being profiled pay nothing. The iterative engine
+    # doesn't call expand_choice, so its nodes aren't timed, only its phases.
+    def instrument(self, generator):
+        namespace_id = generator.parent.namespace_id
+        generator.gen_choice = self._wrap(generator.gen_choice, table_frame(namespace_id))
+        generator.expand_choice = self._wrap(generator.expand_choice, lambda choices_dict, wc: node_frame(wc))
+        for phase in PROFILED_PHASES:
+            setattr(generator, phase, self._wrap(getattr(generator, phase), phase))
+
+    # Rows of (frame name, PhaseStats), the most time consuming first.
+    def report(self):
+        return sorted(self.phases.items(), key=lambda item: item[1].total_seconds, reverse=True)
+
+    def format_report(self):
+        lines = [f'{"phase":<50} {"calls":>8} {"total ms":>10} {"self ms":>10}']
+        for name, stats in self.report():
+            lines.append(f'{name:<50} {stats.calls:>8} {stats.total_seconds * 1000:>10.3f} {stats.self_seconds * 1000:>10.3f}')
+        return '\n'.join(lines)
+
+    # Writes each stack and the microseconds spent in it in the collapsed stack
+    # format that flamegraph.pl, speedscope and similar tools read.
+    def write_collapsed(self, output_file):
+        for stack, seconds in sorted(self.stack_seconds.items()):
+            microseconds = round(seconds * 1e6)
+            if microseconds > 0:
+                output_file.write(f'{";".join(stack)} {microseconds}\n')
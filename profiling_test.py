@@ -0,0 +1,86 @@
+import io
+import unittest
+
+import profiling
+from nested_choices import NestedChoices
+
+# A clock that moves forward one second every time it's read.
+class FakeClock():
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+def load_street_table():
+    table = NestedChoices.load_from_string_list('street', ['A @widths street with @shops'])
+    table.register_subtable(NestedChoices.load_from_string_list('widths', ['wide', 'narrow']))
+    table.register_subtable(NestedChoices.load_from_string_list('shops', ['a bakery', 'a smithy']))
+    return table
+
+class PhaseProfilerTestCase(unittest.TestCase):
+
+    def test_nested_timing(self):
+        profiler = profiling.PhaseProfiler(clock=FakeClock())
+        profiler.enter('outer')      # t=1
+        profiler.enter('inner')      # t=2
+        profiler.exit()              # t=3
+        profiler.exit()              # t=4
+        self.assertEqual(profiler.phases['outer'].total_seconds, 3)
+        self.assertEqual(profiler.phases['outer'].self_seconds, 2)
+        self.assertEqual(profiler.phases['inner'].total_seconds, 1)
+        self.assertEqual(dict(profiler.stack_seconds), {('outer',): 2, ('outer', 'inner'): 1})
+
+    def test_recursive_total_counted_once(self):
+        profiler = profiling.PhaseProfiler(clock=FakeClock())
+        profiler.enter('node')
+        profiler.enter('node')
+        profiler.exit()
+        profiler.exit()
+        self.assertEqual(profiler.phases['node'].calls, 2)
+        self.assertEqual(profiler.phases['node'].total_seconds, 3)
+
+    def test_write_collapsed(self):
+        profiler = profiling.PhaseProfiler(clock=FakeClock())
+        profiler.enter('table:street')
+        profiler.enter('pick_choice')
+        profiler.exit()
+        profiler.exit()
+        output = io.StringIO()
+        profiler.write_collapsed(output)
+        self.assertEqual(output.getvalue(), 'table:street 2000000\ntable:street;pick_choice 1000000\n')
+
+    def test_node_frame(self):
+        wc = NestedChoices.load_from_string_list('t', ['a; b\\tc']).choices
+        self.assertEqual(profiling.node_frame(next(iter(wc))), 'node:a, b\\tc')
+
+class ProfiledGenerationTestCase(unittest.TestCase):
+
+    def test_same_results(self):
+        table = load_street_table()
+        with profiling.profile() as profiler:
+            profiled = table.gen_batch(10, seed=1)
+        self.assertEqual(profiled, table.gen_batch(10, seed=1))
+        self.assertEqual(profiler.phases['table:street'].calls, 10)
+
+    def test_frames(self):
+        table = load_street_table()
+        with profiling.profile() as profiler:
+            table.gen_choices(rng=1)
+        stacks = set(profiler.stack_seconds)
+        self.assertIn(('table:street', 'node:A @widths street with @shops', 'make_replacements', 'make_subtable_calls', 'table:shops', 'choose_for_tag'), stacks)
+        self.assertIn(('table:street', 'choose_for_tag'), stacks)
+        self.assertEqual(profiler.phases['make_subtable_calls'].calls, profiler.phases['make_replacements'].calls)
+
+    def test_inactive_outside_block(self):
+        table = load_street_table()
+        with profiling.profile() as profiler:
+            pass
+        table.gen_choices(rng=1)
+        self.assertEqual(len(profiler.phases), 0)
+        self.assertIsNone(profiling.active_profiler())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 #!/usr/bin/python
 
-import random as rand
 import math
+
+import seeding
 from nested_choices import NestedChoices
 
-def create_character(job_override=None):
+# rng: A seed or random.Random to draw from, see seeding.make_rng.
+def create_character(job_override=None, rng=None):
+  rand = seeding.make_rng(rng)
   name_syllables = ['al', 'ben', 'cor', 'dan', 'fan', 'fer', 'frey', 'gra', 'gar', 'ger', 'hin', 'har',
                     'par', 'pen', 'pul', 'ser', 'star', 'ston', 'nikov', 'wray', 'chill', 'chan', 'lon',
                     'and', 'drak', 'crat', 'yon']
@@ -42,7 +45,7 @@ def create_character(job_override=None):
           'priest', 'guard', 'guard', 'soldier', 'clerk', 'nobleman', 'barkeep', 'clockmaker', 'silversmith',
           'potter', 'cafe proprietor', 'groundskeeper', 'Dolora thug', 'Corela thug', 'Straka thug']
   nested_jobs = NestedChoices.load_from_string_list('random_jobs', jobs)
-  job = nested_jobs.gen_choices()[0]
+  job = nested_jobs.gen_choices(rng=seeding.split_rng(rand))[0]
 
   wealths = ['dirt poor', 'dirt poor', 'poor', 'poor', 'getting by', 'getting by', 'getting by', 'well-off',
             'well-off', 'rich']
@@ -60,7 +63,7 @@ def create_character(job_override=None):
 
   event_choices = NestedChoices.load_from_file('npc_events.txt')
   event_choices.register_subtable(nested_jobs)
-  events = event_choices.gen_choices(params={'num':rand.randint(1, 3), 'uniqueness_level':1})
+  events = event_choices.gen_choices(params={'num':rand.randint(1, 3), 'uniqueness_level':1}, rng=seeding.split_rng(rand))
 
   char = f'{name}, a {age} year(s) old {gender} {race}.\n'
   char += f'They are {relationship}, and ' + ('don\'t have' if children == 0 else f'have {children}') + ' children.\n'
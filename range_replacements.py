@@ -1,14 +1,18 @@
 import re
 import logging
-import random
 import math
 
 import choices_util
+import set_up_logging
 import state_clause_handler
+from state_regexes import PATTERNS, PATTERN_TRIGGERS
 
-def replace_ranges(choice_to_expand, tag, state):
-    logging.debug(f'Replacing ranges for tag {tag} on {choice_to_expand}.')
-    num_replace = re.compile('\[(\d+)-(\d+)(G|N)?(?:%([a-zA-Z]\w+)%)?\]')
+def replace_ranges(choice_to_expand, tag, state, rng):
+    if PATTERN_TRIGGERS['range'] not in choice_to_expand:
+        return choice_to_expand, state
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Replacing ranges for tag {tag} on {choice_to_expand}.')
+    num_replace = PATTERNS['range']
     start = 0
     if tag:
         start = choice_to_expand.find(tag.symbol)+len(tag.symbol)
@@ -25,12 +29,12 @@ def replace_ranges(choice_to_expand, tag, state):
         val = None
         if type == 'N':
             # n = mean, m = stddev
-            val = random.gauss(n, m)
+            val = rng.gauss(n, m)
         elif type == 'G':
             #n = alpha, m = beta
-            val = random.gammavariate(n, m)
+            val = rng.gammavariate(n, m)
         else:
-            val = random.randint(n, m)
+            val = rng.randint(n, m)
 
         # logging.debug(f'Found range {full_match} for choice_to_expand {choice_to_expand}.')
         if match.end() < len(choice_to_expand) and choice_to_expand[match.end()] == '%':
@@ -44,11 +48,13 @@ def replace_ranges(choice_to_expand, tag, state):
 
         val = math.floor(val)
 
-        logging.debug(f'Target state of {target_state}.')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug(f'Target state of {target_state}.')
         if target_state:
             state[target_state] = val
 
         choice_to_expand = choice_to_expand.replace(full_match, str(val))
         match = choices_util.get_next_match(choice_to_expand, num_replace, start)
-    logging.debug(f'Finished replacing ranges on {choice_to_expand} for tag {tag}.')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Finished replacing ranges on {choice_to_expand} for tag {tag}.')
     return choice_to_expand, state
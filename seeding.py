@@ -0,0 +1,34 @@
+import hashlib
+import random
+
+# Derives the seed for one item of a seeded batch. Each item's seed depends only
+# on the master seed and the item's index, so a batch gives the same results
+# however it's split up or ordered.
+def derive_seed(master_seed, index):
+    digest = hashlib.blake2b(f'{master_seed}:{index}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+# The random number generator a generation draws from. Every generation gets
+# its own, so concurrent generations don't interfere, and seeding one makes its
+# results reproducible.
+class GeneratorRandom(random.Random):
+
+    # Returns a new generator, seeded from this one, for a sub-generation such
+    # as a subtable call. The sub-generation's draws then don't shift the draws
+    # of whatever comes after it.
+    def split(self):
+        return GeneratorRandom(self.getrandbits(64))
+
+# rng: A seed, an existing random.Random to use as is, or None for a randomly
+# seeded generator.
+def make_rng(rng=None):
+    if isinstance(rng, random.Random):
+        return rng
+    return GeneratorRandom(rng)
+
+# Works for any random.Random, not just GeneratorRandom.
+def split_rng(rng):
+    if isinstance(rng, GeneratorRandom):
+        return rng.split()
+    return GeneratorRandom(rng.getrandbits(64))
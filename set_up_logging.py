@@ -1,6 +1,21 @@
 import logging
 import argparse
 
+# Whether generation's hot paths log, i.e. whether the root logger they log to
+# takes INFO messages. Building their messages costs more than the work they
+# describe, so rather than build them for logging to drop, this is looked up
+# from the logging config by refresh_hot_path_logging, once per generation.
+HOT_PATH_LOGGING = False
+# The same for their DEBUG messages, which dump whole choices and states.
+HOT_PATH_DEBUG_LOGGING = False
+
+def refresh_hot_path_logging():
+    global HOT_PATH_LOGGING, HOT_PATH_DEBUG_LOGGING
+    logger = logging.getLogger()
+    HOT_PATH_LOGGING = logger.isEnabledFor(logging.INFO)
+    HOT_PATH_DEBUG_LOGGING = logger.isEnabledFor(logging.DEBUG)
+    return HOT_PATH_LOGGING
+
 def set_up_logging(additional_args=[]):
     logging_level = logging.WARNING
     parser = argparse.ArgumentParser(description='Process some integers.')
@@ -1,3 +1,4 @@
+import functools
 import logging
 import math
 import re
@@ -6,10 +7,11 @@ import clause_calculator
 import set_up_logging
 import choices_util
 
-from state_regexes import STATE_REGEXES
+from state_regexes import PATTERNS, PATTERN_TRIGGERS, STATE_REGEXES
 
 from collections import defaultdict
 
+
 class StateClauseHandler():
 
     def __init__(self):
@@ -100,33 +102,13 @@ class StateClauseHandler():
         self.type = 'state_interpolation'
         self.target_state = match.group(1)
 
-        if self.target_state not in self.state.keys():
+        if self.target_state not in self.state:
             return None
         else:
             return self.state[self.target_state]
 
     def calculate_modification(self):
-        value = None
-        if self.effect == '*=':
-            value = self.target * self.magnitude
-        elif self.effect == '+=':
-            value = self.target + self.magnitude
-        elif self.effect == '-=':
-            value = self.target - self.magnitude
-        elif self.effect == '/=':
-            value = self.target / self.magnitude
-        elif self.effect == '^=':
-            value = self.target ** self.magnitude
-        elif self.effect == '=':
-            value = self.magnitude
-        elif self.effect == '@':
-            value = self.choice_value
-        else:
-            raise ValueError(f'Got unrecognized effect {self.effect} while handling {self.condition}!')
-
-        # logging.debug(f'Calculated modification of {value}')
-
-        return value
+        return calculate_modification(self.effect, self.target, self.magnitude, self.choice_value, self.condition)
 
     def calculate_magnitude(self):
         value = clause_calculator.calculate(self.magnitude, self.state)
@@ -140,31 +122,99 @@ class StateClauseHandler():
         return value
 
 
-def evaluate_value_modification(condition, target, state):
-    assert '@' not in condition, f'"@" provided in value modification {condition}, which is not allowed. "@" is only allowed in state modification.'
-    handler = StateClauseHandler()
-    handler.condition = condition
-    handler.target = target
-    handler.state = state
-    value_modification = re.fullmatch(STATE_REGEXES['value_modification'], condition)
-    conditional_value_modification = re.fullmatch(STATE_REGEXES['conditional_value_modification'], condition)
-
-    if conditional_value_modification:
-        # logging.info('got conditional_value_modification')
-        return handler.process_conditional_value_modification(conditional_value_modification)
-    elif value_modification:
-        # logging.info('got value_modification')
-        return handler.process_value_modification(value_modification)
+def calculate_modification(effect, target, magnitude, choice_value, condition):
+    value = None
+    if effect == '*=':
+        value = target * magnitude
+    elif effect == '+=':
+        value = target + magnitude
+    elif effect == '-=':
+        value = target - magnitude
+    elif effect == '/=':
+        value = target / magnitude
+    elif effect == '^=':
+        value = target ** magnitude
+    elif effect == '=':
+        value = magnitude
+    elif effect == '@':
+        value = choice_value
     else:
-        raise ValueError(f'condition "{condition}" passed to evaluate_value_modification was not of a value modification form!')
+        raise ValueError(f'Got unrecognized effect {effect} while handling {condition}!')
+
+    # logging.debug(f'Calculated modification of {value}')
+
+    return value
+
+# A value modification clause, such as '%wealth>5->+=wealth*2%', parsed once
+# when its choice is loaded, so that weighing the choice doesn't have to match
+# it against the state regexes again. The condition and magnitude are compiled
+# by clause_calculator the first time they're calculated.
+class ValueModification():
+
+    def __init__(self, clause, condition, effect, magnitude):
+        self.clause = clause
+        # None if the modification always applies.
+        self.condition = condition
+        self.effect = effect
+        self.magnitude = magnitude
+        self._calculate_condition = None
+        self._calculate_magnitude = None
+
+    # The compiled calculations are rebuilt after unpickling, since they're closures.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_calculate_condition'] = None
+        state['_calculate_magnitude'] = None
+        return state
+
+    def apply(self, target, state):
+        if self._calculate_magnitude is None:
+            if self.condition is not None:
+                self._calculate_condition = compile_calculation(self.condition)
+            self._calculate_magnitude = compile_calculation(self.magnitude)
+
+        if self.condition is not None:
+            condition = self._calculate_condition(state)
+            magnitude = self._calculate_magnitude(state)
+            if not condition:
+                return target
+        else:
+            magnitude = self._calculate_magnitude(state)
+        return calculate_modification(self.effect, target, magnitude, None, self.clause)
+
+    def __repr__(self):
+        return f'ValueModification({self.clause!r})'
+
+# Returns a function of the state that calculates clause, the same as
+# clause_calculator.calculate.
+def compile_calculation(clause):
+    if not clause:
+        return lambda state: ''
+    return clause_calculator.compile_clause(clause)
+
+# Choices often share clauses, so they share the parsed modifications too, for
+# as many clauses as clause_calculator keeps compiled.
+@functools.lru_cache(maxsize=clause_calculator.MAX_COMPILED_CLAUSES)
+def parse_value_modification(clause):
+    assert '@' not in clause, f'"@" provided in value modification {clause}, which is not allowed. "@" is only allowed in state modification.'
+    conditional_value_modification = PATTERNS['conditional_value_modification'].fullmatch(clause)
+    if conditional_value_modification:
+        return ValueModification(clause, *conditional_value_modification.group(1, 2, 3))
+    value_modification = PATTERNS['value_modification'].fullmatch(clause)
+    if value_modification:
+        return ValueModification(clause, None, *value_modification.group(1, 2))
+    raise ValueError(f'condition "{clause}" passed to evaluate_value_modification was not of a value modification form!')
+
+def evaluate_value_modification(condition, target, state):
+    return parse_value_modification(condition).apply(target, state)
 
 def evaluate_state_modification(condition, choice_value, state):
     handler = StateClauseHandler()
     handler.condition = condition
     handler.state = state
     handler.choice_value = choice_value
-    state_modification = re.fullmatch(STATE_REGEXES['state_modification'], condition)
-    conditional_state_modification = re.fullmatch(STATE_REGEXES['conditional_state_modification'], condition)
+    state_modification = PATTERNS['state_modification'].fullmatch(condition)
+    conditional_state_modification = PATTERNS['conditional_state_modification'].fullmatch(condition)
 
     if conditional_state_modification:
         # logging.info('got conditional_state_modification')
@@ -178,28 +228,32 @@ def evaluate_state_modification(condition, choice_value, state):
         raise ValueError(f'condition "{condition}" passed to evaluate_state_modification was not of a state modification form!')
 
 def evaluate_state_interpolation(condition, state):
-    logging.debug(f'Calculating interpolation value for "{condition}".')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Calculating interpolation value for "{condition}".')
     handler = StateClauseHandler()
     handler.condition = condition
     handler.state = state
-    state_interpolation = re.fullmatch(STATE_REGEXES['state_interpolation'], condition)
-    conditional_state_interpolation = re.fullmatch(STATE_REGEXES['conditional_state_interpolation'], condition)
-    plain_state_interpolation = re.fullmatch(STATE_REGEXES['plain_state_interpolation'], condition)
+    state_interpolation = PATTERNS['state_interpolation'].fullmatch(condition)
+    conditional_state_interpolation = PATTERNS['conditional_state_interpolation'].fullmatch(condition)
+    plain_state_interpolation = PATTERNS['plain_state_interpolation'].fullmatch(condition)
 
     if plain_state_interpolation:
         # If we get a stand-alone state, we only display it if it's present in the dictionary.
         # We don't display default values for these.
-        logging.debug('got plain_state_interpolation')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug('got plain_state_interpolation')
         state_name = plain_state_interpolation.group(2)
-        if state_name not in state.keys():
+        if state_name not in state:
             return None
 
     if conditional_state_interpolation:
-        logging.debug('got conditional_state_interpolation')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug('got conditional_state_interpolation')
         value = handler.process_conditional_state_interpolation(conditional_state_interpolation)
         return value
     elif state_interpolation:
-        logging.debug('got state_interpolation')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug('got state_interpolation')
         value = handler.process_state_interpolation(state_interpolation)
         return value
     else:
@@ -207,18 +261,22 @@ def evaluate_state_interpolation(condition, state):
 
 
 def process_state_tag(choice_to_expand, tag):
-    logging.debug(f'Processing state tag for tag {tag} on {choice_to_expand}')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Processing state tag for tag {tag} on {choice_to_expand}')
     start = choice_to_expand.find(tag.symbol)
     tag_end = start + len(tag.symbol)
-    tag_truncated_choice = choice_to_expand[tag_end:]
-    # logging.debug(f'tag_truncated_choice {tag_truncated_choice}')
-    pattern = re.compile(STATE_REGEXES['tag_state'])
+    if not choice_to_expand.startswith(PATTERN_TRIGGERS['tag_state'], tag_end):
+        return choice_to_expand, None
+    # logging.debug(f'tag_truncated_choice {choice_to_expand[tag_end:]}')
+    pattern = PATTERNS['tag_state']
     match = pattern.match(choice_to_expand, tag_end)
     if match:
-        logging.debug(f'Got match {match}')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug(f'Got match {match}')
         state_to_update = match.group(1)
         choice_to_expand = choice_to_expand[:match.start()] + choice_to_expand[match.end():]
-        logging.debug(f'Found state {state_to_update} to store value in.')
+        if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+            logging.debug(f'Found state {state_to_update} to store value in.')
         return choice_to_expand, state_to_update
     else:
         # logging.debug(f'No match')
@@ -0,0 +1,64 @@
+import collections
+import pickle
+import unittest
+
+import clause_calculator
+import state_clause_handler
+from nested_choices import WeightedChoice
+from state_regexes import PATTERNS, PATTERN_TRIGGERS, STATE_REGEXES
+
+class ValueModificationTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        modification = state_clause_handler.parse_value_modification('%wealth>5->+=wealth*2%')
+        self.assertEqual((modification.condition, modification.effect, modification.magnitude), ('wealth>5', '+=', 'wealth*2'))
+        modification = state_clause_handler.parse_value_modification('%*=age_pct/100%')
+        self.assertEqual((modification.condition, modification.effect, modification.magnitude), (None, '*=', 'age_pct/100'))
+
+    def test_parse_invalid(self):
+        with self.assertRaises(ValueError):
+            state_clause_handler.parse_value_modification('%wealth%')
+        with self.assertRaises(AssertionError):
+            state_clause_handler.parse_value_modification('%=@%')
+
+    def test_apply(self):
+        modification = state_clause_handler.parse_value_modification('%wealth>5->+=wealth*2%')
+        self.assertEqual(modification.apply(10, {'wealth': 6}), 22)
+        self.assertEqual(modification.apply(10, {'wealth': 5}), 10)
+        self.assertEqual(state_clause_handler.evaluate_value_modification('%-=wealth/2%', 10, {'wealth': 5}), 8)
+
+    def test_state_read_in_order(self):
+        state = collections.defaultdict(int)
+        state_clause_handler.parse_value_modification('%bb>aa->=cc%').apply(1, state)
+        self.assertEqual(list(state), ['bb', 'aa', 'cc'])
+
+    def test_parsed_on_load(self):
+        wc = WeightedChoice(10, 'rich', clause='%+=wealth%')
+        self.assertEqual(wc.value_modification.effect, '+=')
+        self.assertIsNone(WeightedChoice(10, 'poor').value_modification)
+
+    def test_bounded(self):
+        self.assertEqual(state_clause_handler.parse_value_modification.cache_info().maxsize, clause_calculator.MAX_COMPILED_CLAUSES)
+
+    def test_pickle(self):
+        modification = state_clause_handler.parse_value_modification('%+=wealth*3%')
+        modification.apply(1, {'wealth': 1})
+        unpickled = pickle.loads(pickle.dumps(modification))
+        self.assertEqual(unpickled.apply(1, {'wealth': 2}), 7)
+
+class PatternsTestCase(unittest.TestCase):
+
+    def test_every_pattern_has_a_trigger(self):
+        self.assertEqual(set(PATTERNS), set(PATTERN_TRIGGERS))
+        self.assertLessEqual(set(STATE_REGEXES), set(PATTERNS))
+
+    def test_triggers_required(self):
+        samples = ['%wealth:+=1%', ' %wealth:+=1%', '%wealth%', '%age>18->=0%', '[1-6]', '[1-6N%age%]', '@colors[2,0]', '$', '%home:@%']
+        for name, pattern in PATTERNS.items():
+            for sample in samples:
+                if pattern.search(sample):
+                    self.assertIn(PATTERN_TRIGGERS[name], sample, name)
+                    self.assertIsNone(pattern.search(sample.replace(PATTERN_TRIGGERS[name], '')), name)
+
+if __name__ == '__main__':
+    unittest.main()
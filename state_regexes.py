@@ -1,3 +1,5 @@
+import re
+
 import set_up_logging
 
 SPECIAL_CHARS = '[ \(\)]'
@@ -35,6 +37,22 @@ STATE_REGEXES = {
     'tag_state': f'%({STATE_RE}):({CURRENT_VALUE_RE})%'
 }
 
+RANGE_RE = '\[(\d+)-(\d+)(G|N)?(?:%([a-zA-Z]\w+)%)?\]'
+SUBTABLE_CALL_RE = '@([a-zA-Z_]+)(\[(\d+)(?:-(\d+))?, ?(-?\d+)\])?'
+UNNUMBERED_TAG_RE = '\$(?!\[\d+\])'
+
+# Every pattern used while generating, compiled once. Each one can only match
+# text containing the character it's listed with in PATTERN_TRIGGERS, so callers
+# can skip the search entirely when that character isn't there.
+PATTERNS = {name: re.compile(regex) for name, regex in STATE_REGEXES.items()}
+PATTERNS['range'] = re.compile(RANGE_RE)
+PATTERNS['subtable_call'] = re.compile(SUBTABLE_CALL_RE)
+PATTERNS['unnumbered_tag'] = re.compile(UNNUMBERED_TAG_RE)
+PATTERN_TRIGGERS = {name: '%' for name in STATE_REGEXES}
+PATTERN_TRIGGERS['range'] = '['
+PATTERN_TRIGGERS['subtable_call'] = '@'
+PATTERN_TRIGGERS['unnumbered_tag'] = '$'
+
 
 if __name__ == '__main__':
     args = set_up_logging.set_up_logging(['--dump_regexes'])
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+# How many results an async stream hands out before giving other tasks a turn.
+YIELD_EVERY = 100
+
+def to_jsonl_line(result):
+    return json.dumps(result, ensure_ascii=False) + '\n'
+
+# Wraps any iterable of results, such as NestedChoices.iter_choices, as an async
+# iterator. Generation is CPU bound, so this just makes sure other tasks on the
+# event loop get to run every so often during a long run.
+async def aiter_results(results, yield_every=YIELD_EVERY):
+    for i, result in enumerate(results, 1):
+        yield result
+        if i % yield_every == 0:
+            await asyncio.sleep(0)
+
+# Writes each result to output_file as one JSON string per line, as soon as it's
+# generated, so memory stays flat however many results there are. Returns the
+# number of results written.
+def write_jsonl(results, output_file):
+    count = 0
+    for result in results:
+        output_file.write(to_jsonl_line(result))
+        count += 1
+    return count
+
+# The same as write_jsonl, but to an asyncio.StreamWriter, such as a socket.
+# Waits for the writer to drain as it goes, so a slow reader holds generation
+# back instead of having results pile up in the writer's buffer.
+#
+# results: An iterable or async iterable of results.
+async def write_jsonl_async(results, writer):
+    if not hasattr(results, '__aiter__'):
+        results = aiter_results(results)
+    count = 0
+    async for result in results:
+        writer.write(to_jsonl_line(result).encode('utf-8'))
+        await writer.drain()
+        count += 1
+    return count
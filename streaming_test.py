@@ -0,0 +1,66 @@
+import asyncio
+import io
+import json
+import unittest
+
+from nested_choices import NestedChoices
+
+import streaming
+
+def load_colors_table():
+    return NestedChoices.load_from_string_list('colors', [f'color {i}' for i in range(50)])
+
+# Collects what's written to it, like an asyncio.StreamWriter on a socket.
+class FakeWriter():
+
+    def __init__(self):
+        self.written = b''
+        self.drains = 0
+
+    def write(self, data):
+        self.written += data
+
+    async def drain(self):
+        self.drains += 1
+
+async def collect(results):
+    return [result async for result in results]
+
+class StreamingTestCase(unittest.TestCase):
+
+    def test_iter_choices_matches_gen_choices(self):
+        colors = load_colors_table()
+        params = {'num': 20, 'uniqueness_level': 1}
+        self.assertEqual(list(colors.iter_choices(params, rng=4)), colors.gen_choices(params, rng=4))
+
+    def test_iter_choices_is_lazy(self):
+        results = load_colors_table().iter_choices({'num': 10**9, 'uniqueness_level': 0})
+        self.assertEqual(len([next(results) for _ in range(5)]), 5)
+
+    def test_aiter_choices(self):
+        colors = load_colors_table()
+        params = {'num': 250, 'uniqueness_level': 0}
+        self.assertEqual(asyncio.run(collect(colors.aiter_choices(params, rng=2))), colors.gen_choices(params, rng=2))
+
+    def test_write_jsonl(self):
+        output = io.StringIO()
+        results = ['plain', 'with "quotes"', 'two\nlines']
+        self.assertEqual(streaming.write_jsonl(iter(results), output), 3)
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], results)
+
+    def test_write_jsonl_async(self):
+        writer = FakeWriter()
+        colors = load_colors_table()
+        params = {'num': 30, 'uniqueness_level': 0}
+        self.assertEqual(asyncio.run(streaming.write_jsonl_async(colors.aiter_choices(params, rng=3), writer)), 30)
+        lines = writer.written.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], colors.gen_choices(params, rng=3))
+        self.assertEqual(writer.drains, 30)
+
+    def test_write_jsonl_async_from_iterable(self):
+        writer = FakeWriter()
+        self.assertEqual(asyncio.run(streaming.write_jsonl_async(['a', 'b'], writer)), 2)
+        self.assertEqual(writer.written, b'"a"\n"b"\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,18 @@
 import re
 import logging
-import random
 import choices_util
+import seeding
+import set_up_logging
+from state_regexes import PATTERNS, PATTERN_TRIGGERS
 
-def make_subtable_calls(parent, choice_to_expand, tag, state):
-    logging.debug(f'Making subtable calls for tag {tag} on {choice_to_expand}.')
-    subtable_replace = re.compile('@([a-zA-Z_]+)(\[(\d+)(?:-(\d+))?, ?(-?\d+)\])?')
+# engine: The engine to generate the subtables' choices with, see
+# NestedChoices.gen_choices. None for the default.
+def make_subtable_calls(parent, choice_to_expand, tag, state, rng, engine=None):
+    if PATTERN_TRIGGERS['subtable_call'] not in choice_to_expand:
+        return choice_to_expand, state
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Making subtable calls for tag {tag} on {choice_to_expand}.')
+    subtable_replace = PATTERNS['subtable_call']
     start = 0
     if tag:
         start = choice_to_expand.find(tag.symbol)+len(tag.symbol)
@@ -20,7 +27,7 @@ def make_subtable_calls(parent, choice_to_expand, tag, state):
         # If both of these are filled out, we have a variable-length subtable call
         if base_num_to_gen != None and end_num_to_gen != None:
             # end_num_to_gen = end_num_to_gen[1:]
-            num_to_gen = random.randint(int(base_num_to_gen), int(end_num_to_gen))
+            num_to_gen = rng.randint(int(base_num_to_gen), int(end_num_to_gen))
         elif base_num_to_gen == None:
             num_to_gen = 1
         else:
@@ -31,10 +38,13 @@ def make_subtable_calls(parent, choice_to_expand, tag, state):
         else:
             uniqueness_level = int(uniqueness_level)
 
-        logging.info(f'making call to subtable {subtable_id} with num_to_gen={num_to_gen} and uniqueness_level={uniqueness_level}.')
+        if set_up_logging.HOT_PATH_LOGGING:
+            logging.info(f'making call to subtable {subtable_id} with num_to_gen={num_to_gen} and uniqueness_level={uniqueness_level}.')
 
         params = {'num':num_to_gen, 'uniqueness_level':uniqueness_level}
-        subtable_choices, new_state = parent.call_subtable(subtable_id, params)
+        if engine is not None:
+            params['engine'] = engine
+        subtable_choices, new_state = parent.call_subtable(subtable_id, params, seeding.split_rng(rng))
         state = merge_state(state, new_state)
 
         choice_to_expand, open, close = choices_util.handle_brace_enclosure(match.start(), choice_to_expand, delete_all=False)
@@ -48,7 +58,8 @@ def make_subtable_calls(parent, choice_to_expand, tag, state):
 
         # match = subtable_replace.search(choice_to_expand)
         match = choices_util.get_next_match(choice_to_expand, subtable_replace, start)
-    logging.debug(f'Finished making subtable calls for tag {tag} on {choice_to_expand}.')
+    if set_up_logging.HOT_PATH_DEBUG_LOGGING:
+        logging.debug(f'Finished making subtable calls for tag {tag} on {choice_to_expand}.')
     return choice_to_expand, state
 
 def replace_repeated_subtable_clauses(choice_to_expand, subtable_choices, subtable_id):
@@ -76,8 +87,9 @@ def replace_repeated_subtable_clauses(choice_to_expand, subtable_choices, subtab
         numbered_id = '@' + str(i) + subtable_id
     return choice_to_expand
 
+# new_state only holds what the subtable's generation touched, which starts
+# from nothing, since subtables can't see their caller's state.
 def merge_state(state, new_state):
-    for key, value in new_state.items():
-        # logging.info(f'Writing to state: {key}, {value}.')
-        state[key] = value
+    # logging.info(f'Writing to state: {new_state}.')
+    state.update(new_state)
     return state
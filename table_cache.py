@@ -0,0 +1,103 @@
+import collections
+import logging
+import os
+import threading
+
+DEFAULT_MAX_ENTRIES = 128
+
+def resolve_path(filename):
+    return os.path.realpath(filename)
+
+# Identifies a version of a file on disk without having to read it.
+def file_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CacheEntry():
+
+    # stamps: Dict of resolved path to file_stamp, for the table's file and
+    # every file it imports, so that editing an import invalidates its importers.
+    def __init__(self, value, stamps):
+        self.value = value
+        self.stamps = stamps
+
+    def is_fresh(self):
+        try:
+            return all(file_stamp(path) == stamp for path, stamp in self.stamps.items())
+        except OSError:
+            # A source file was removed or renamed.
+            return False
+
+
+# An LRU cache of compiled tables, keyed by resolved path. A hit only stats the
+# source files, it never reads, strips, validates or re-trees them.
+#
+# compile_table is called on a miss with the requested filename, and must return
+# an object with a 'source_stamps' attribute in the format used by CacheEntry.
+class TableCache():
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        assert max_entries > 0, f'TableCache needs room for at least one entry, but was given max_entries={max_entries}.'
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, filename):
+        return resolve_path(filename) in self.entries
+
+    def get(self, filename, compile_table):
+        value = self.lookup(filename)
+        if value is not None:
+            return value
+
+        with self.lock:
+            self.misses += 1
+        value = compile_table(filename)
+        self.put(filename, value, value.source_stamps)
+        return value
+
+    # Returns the cached table for the file, or None if it isn't cached or is stale.
+    def lookup(self, filename):
+        path = resolve_path(filename)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            if not entry.is_fresh():
+                logging.debug(f'Cached table for {path} is stale, recompiling.')
+                del self.entries[path]
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry.value
+
+    def put(self, filename, value, stamps):
+        path = resolve_path(filename)
+        with self.lock:
+            self.entries[path] = CacheEntry(value, stamps)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                logging.debug(f'Evicted {evicted} from the table cache.')
+
+    # Drops the given file from the cache, along with anything that imported it.
+    # With no filename, empties the cache entirely.
+    def invalidate(self, filename=None):
+        with self.lock:
+            if filename is None:
+                self.entries.clear()
+                return
+            path = resolve_path(filename)
+            for cached_path in [p for p, entry in self.entries.items() if path in entry.stamps]:
+                del self.entries[cached_path]
+            self.entries.pop(path, None)
+
+
+# Shared by every NestedChoices.load_from_file call in the process.
+TABLE_CACHE = TableCache()
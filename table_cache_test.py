@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import choices_validator
+import table_cache
+from nested_choices import NestedChoices
+
+class TableCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = table_cache.TableCache(max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_table(self, name, data, imports=[], mtime_offset=0):
+        filename = os.path.join(self.dir, name + '.txt')
+        header = name + '\n' + ''.join(f'{i}:{os.path.join(self.dir, i)}.txt\n' for i in imports)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(header + '\n' + data)
+        # Make sure rewrites are visible even on filesystems with coarse mtimes.
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+        return filename
+
+    def load(self, filename):
+        return NestedChoices.load_from_file(filename, cache=self.cache)
+
+    def test_warm_load_skips_validation(self):
+        filename = self.write_table('colors', '1 red\n\n1 blue')
+        self.load(filename)
+        with mock.patch.object(choices_validator, 'validate_choices') as validate:
+            choices = self.load(filename)
+        validate.assert_not_called()
+        self.assertIn(choices.gen_choices()[0], ['red', 'blue'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_loads_are_copies(self):
+        filename = self.write_table('colors', '1 red')
+        first = self.load(filename)
+        first.register_subtable(NestedChoices.load_from_string_list('extra', ['thing']))
+        second = self.load(filename)
+        self.assertNotIn('extra', second.subtables)
+        self.assertIs(first.choices, second.choices)
+
+    def test_modified_file_is_recompiled(self):
+        filename = self.write_table('colors', '1 red')
+        self.load(filename)
+        self.write_table('colors', '1 green', mtime_offset=10**9)
+        self.assertEqual(self.load(filename).gen_choices(), ['green'])
+
+    def test_modified_import_recompiles_importer(self):
+        self.write_table('shade', '1 dark')
+        filename = self.write_table('colors', '1 @shade red', imports=['shade'])
+        self.assertEqual(self.load(filename).gen_choices(), ['dark red'])
+        self.write_table('shade', '1 light', mtime_offset=10**9)
+        self.assertEqual(self.load(filename).gen_choices(), ['light red'])
+
+    def test_least_recently_used_is_evicted(self):
+        red = self.write_table('red', '1 red')
+        green = self.write_table('green', '1 green')
+        blue = self.write_table('blue', '1 blue')
+        self.load(red)
+        self.load(green)
+        self.load(red)
+        self.load(blue)
+        self.assertIn(red, self.cache)
+        self.assertNotIn(green, self.cache)
+        self.assertIn(blue, self.cache)
+
+    def test_invalidate_drops_importers(self):
+        self.write_table('shade', '1 dark')
+        filename = self.write_table('colors', '1 @shade red', imports=['shade'])
+        self.load(filename)
+        self.cache.invalidate(os.path.join(self.dir, 'shade.txt'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_all(self):
+        self.load(self.write_table('red', '1 red'))
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
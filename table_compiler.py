@@ -0,0 +1,225 @@
+import argparse
+import array
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+
+# Layout of a compiled table artifact:
+#   HEADER: magic, format version, length of the index.
+#   Index: marshalled dict with the stamps of every source file, the offset and
+#     length of the string table in the body, and for each table its path,
+#     namespace id, imported paths, and the offset and length of its tree in
+#     the body.
+#   Body: the marshalled string table, then one marshalled, flattened tree per
+#     table.
+# Every distinct choice text and clause is stored once, in the string table,
+# which the trees refer to by index. Trees are only decoded when a table's
+# choices are first used, so tables that a generation never calls into cost
+# nothing beyond reading the index.
+MAGIC = b'NCT\x00'
+FORMAT_VERSION = 3
+ARTIFACT_EXTENSION = '.nct'
+HEADER = struct.Struct('<4sII')
+
+def artifact_path(filename):
+    return os.path.splitext(filename)[0] + ARTIFACT_EXTENSION
+
+# Gives each distinct string an index in a string table, shared by every tree
+# in an artifact.
+class StringPool():
+
+    def __init__(self):
+        self.strings = []
+        self.indices = {}
+
+    def add(self, string):
+        index = self.indices.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.indices[string] = index
+            self.strings.append(string)
+        return index
+
+# Packs non-negative ints, such as string table indices, into as few bytes each
+# as the largest needs, as (typecode, little endian bytes). marshal would take
+# five bytes for each.
+def pack_ints(ints):
+    largest = max(ints, default=0)
+    for typecode in 'BHIQ':
+        if largest < 1 << (8 * array.array(typecode).itemsize):
+            break
+    packed = array.array(typecode, ints)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return typecode, packed.tobytes()
+
+def unpack_ints(packed):
+    typecode, data = packed
+    ints = array.array(typecode, data)
+    if sys.byteorder == 'big':
+        ints.byteswap()
+    return ints
+
+# Flattens a choices tree into parallel preorder sequences, which marshal stores
+# far more compactly than nested dicts. Choice texts are stored as their
+# indices in strings, a StringPool, and clauses as their indices plus one, with
+# 0 for no clause. Source lines are stored with 0 for none.
+def encode_tree(choices_tree, strings):
+    weights, tag_nums, clauses, choices, lines, child_counts = [], [], [], [], [], []
+    stack = [iter(choices_tree.items())]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        wc, children = item
+        weights.append(wc.weight)
+        tag_nums.append(wc.tag_num)
+        clauses.append(strings.add(wc.clause) + 1 if wc.clause is not None else 0)
+        choices.append(strings.add(wc.choice))
+        lines.append(wc.line or 0)
+        child_counts.append(len(children))
+        if children:
+            stack.append(iter(children.items()))
+    return len(choices_tree), tuple(weights), pack_ints(tag_nums), pack_ints(clauses), pack_ints(choices), pack_ints(lines), pack_ints(child_counts)
+
+# strings: The string table the tree was encoded with, as a sequence.
+# make_choice: Called with (weight, choice, tag_num, clause, line), returns a
+# tree key.
+# make_dict: Called with no arguments, returns an empty dict for a node's children.
+def decode_tree(encoded, strings, make_choice, make_dict=dict):
+    top_level_count, weights, tag_nums, clauses, choices, lines, child_counts = encoded
+    tag_nums = unpack_ints(tag_nums)
+    clauses = unpack_ints(clauses)
+    choices = unpack_ints(choices)
+    lines = unpack_ints(lines)
+    child_counts = unpack_ints(child_counts)
+    choices_tree = make_dict()
+    # Pairs of [dict being filled, number of children still to add to it].
+    stack = [[choices_tree, top_level_count]]
+    for i in range(len(weights)):
+        while stack[-1][1] == 0:
+            stack.pop()
+        parent = stack[-1]
+        parent[1] -= 1
+        children = make_dict()
+        clause = strings[clauses[i] - 1] if clauses[i] else None
+        parent[0][make_choice(weights[i], strings[choices[i]], tag_nums[i], clause, lines[i] or None)] = children
+        if child_counts[i]:
+            stack.append([children, child_counts[i]])
+    return choices_tree
+
+
+# An artifact's string table, decoded the first time any of its tables is.
+class StringTable():
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self._strings = None
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            # Interned, so they're shared with the same text in every other table.
+            self._strings = tuple(sys.intern(string) for string in marshal.loads(self.buffer[self.offset:self.offset + self.length]))
+        return self._strings
+
+
+class CompiledTable():
+
+    def __init__(self, buffer, string_table, path, namespace_id, import_paths, offset, length):
+        self.buffer = buffer
+        self.string_table = string_table
+        self.path = path
+        self.namespace_id = namespace_id
+        self.import_paths = import_paths
+        self.offset = offset
+        self.length = length
+
+    def load_choices(self, make_choice, make_dict=dict):
+        logging.debug(f'Decoding compiled table {self.namespace_id}.')
+        encoded = marshal.loads(self.buffer[self.offset:self.offset + self.length])
+        return decode_tree(encoded, self.string_table.strings, make_choice, make_dict)
+
+
+# tables: List of (path, namespace_id, import_paths, choices_tree), where every
+# table comes after the tables it imports.
+# sources: Dict of source path to table_cache.file_stamp.
+def write_artifact(artifact_filename, tables, sources):
+    strings = StringPool()
+    encoded_trees = [encode_tree(choices_tree, strings) for _, _, _, choices_tree in tables]
+    blobs = [marshal.dumps(tuple(strings.strings))]
+    offset = len(blobs[0])
+    index_tables = []
+    for (path, namespace_id, import_paths, _), encoded in zip(tables, encoded_trees):
+        blob = marshal.dumps(encoded)
+        index_tables.append((path, namespace_id, tuple(import_paths), offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+    index = marshal.dumps({'sources': sources, 'strings': (0, len(blobs[0])), 'tables': index_tables})
+
+    # Write to the side and swap in, so readers never see a partial artifact.
+    temp_filename = artifact_filename + '.tmp'
+    with open(temp_filename, 'wb') as artifact_file:
+        artifact_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(index)))
+        artifact_file.write(index)
+        for blob in blobs:
+            artifact_file.write(blob)
+    os.replace(temp_filename, artifact_filename)
+    logging.info(f'Wrote {len(tables)} compiled tables to {artifact_filename}.')
+
+# Returns (sources, tables), with tables in the order they were written.
+def open_artifact(artifact_filename):
+    with open(artifact_filename, 'rb') as artifact_file:
+        buffer = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buffer) < HEADER.size:
+        raise ValueError(f'Compiled table {artifact_filename} is truncated.')
+    magic, version, index_length = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f'Compiled table {artifact_filename} has magic {magic} and version {version}, expected {MAGIC} and {FORMAT_VERSION}.')
+
+    body_start = HEADER.size + index_length
+    index = marshal.loads(buffer[HEADER.size:body_start])
+    strings_offset, strings_length = index['strings']
+    string_table = StringTable(buffer, body_start + strings_offset, strings_length)
+    tables = [CompiledTable(buffer, string_table, path, namespace_id, list(import_paths), body_start + offset, length)
+              for path, namespace_id, import_paths, offset, length in index['tables']]
+    return index['sources'], tables
+
+# An artifact is only used if every file that went into it is exactly as it was
+# when it was compiled, going by the stamps it saved, and none is newer than it.
+# A file restored to an older version, as a checkout does, can have an older
+# mtime but still be different. Returns the current stamps of the sources if
+# so, or None.
+def check_sources(artifact_filename, sources):
+    artifact_mtime = os.stat(artifact_filename).st_mtime_ns
+    current_stamps = {}
+    for path, stamp in sources.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        current_stamp = stat.st_mtime_ns, stat.st_size
+        if current_stamp != tuple(stamp) or stat.st_mtime_ns > artifact_mtime:
+            return None
+        current_stamps[path] = current_stamp
+    return current_stamps
+
+
+if __name__ == '__main__':
+    from nested_choices import NestedChoices
+
+    parser = argparse.ArgumentParser(description='Precompile choices files, and everything they import.')
+    parser.add_argument('filenames', nargs='+')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    for filename in args.filenames:
+        print(NestedChoices.compile_to_artifact(filename))
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import table_compiler
+from nested_choices import NestedChoices, WeightedChoice
+
+def tree_to_tuples(choices_tree):
+    return [(wc.weight, wc.tag_num, wc.clause, wc.choice, wc.line, tree_to_tuples(children)) for wc, children in choices_tree.items()]
+
+class TableCompilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_table(self, name, data, imports=[]):
+        filename = os.path.join(self.dir, name + '.txt')
+        header = name + '\n' + ''.join(f'{i}:{os.path.join(self.dir, i)}.txt\n' for i in imports)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(header + '\n' + data)
+        return filename
+
+    def set_mtime(self, filename, mtime_ns):
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+    def test_tree_round_trip(self):
+        choices = NestedChoices.load_from_string_list('t', ['plain', 'text'], [3, 2])
+        choices_tree = NestedChoices.choices_string_to_tree('1 $ and $\n  2%+=wealth% a\n    1 deep\n  $\n  1 b\n\n5 c')
+        strings = table_compiler.StringPool()
+        encoded = table_compiler.encode_tree(choices_tree, strings)
+        self.assertEqual(tree_to_tuples(table_compiler.decode_tree(encoded, strings.strings, WeightedChoice)), tree_to_tuples(choices_tree))
+        encoded = table_compiler.encode_tree(choices.choices, strings)
+        self.assertEqual(tree_to_tuples(table_compiler.decode_tree(encoded, strings.strings, WeightedChoice)), tree_to_tuples(choices.choices))
+
+    def test_strings_stored_once(self):
+        choices_tree = NestedChoices.choices_string_to_tree('1 $\n  1 red\n  1 blue\n\n1 $\n  1 red\n  1%+=wealth% blue\n  1%+=wealth% green')
+        strings = table_compiler.StringPool()
+        table_compiler.encode_tree(choices_tree, strings)
+        self.assertEqual(sorted(strings.strings), sorted(['$', 'red', 'blue', 'green', '%+=wealth%']))
+
+    def test_prefers_fresh_artifact(self):
+        self.write_table('shade', '1 dark')
+        filename = self.write_table('colors', '1 @shade red', imports=['shade'])
+        NestedChoices.compile_to_artifact(filename)
+
+        loaded = NestedChoices.load_compiled(filename)
+        self.assertIsNotNone(loaded)
+        # Nothing is decoded until it's used.
+        self.assertIsNotNone(loaded.subtables['shade']._load_choices)
+        self.assertEqual(loaded.gen_choices(), ['dark red'])
+        self.assertEqual(NestedChoices.load_from_file(filename, cache=None).gen_choices(), ['dark red'])
+
+    def test_ignores_artifact_older_than_sources(self):
+        self.write_table('shade', '1 dark')
+        filename = self.write_table('colors', '1 @shade red', imports=['shade'])
+        artifact = NestedChoices.compile_to_artifact(filename)
+        self.set_mtime(artifact, 10**18)
+
+        shade = self.write_table('shade', '1 light')
+        self.set_mtime(shade, 2 * 10**18)
+        self.assertIsNone(NestedChoices.load_compiled(filename))
+        self.assertEqual(NestedChoices.load_from_file(filename, cache=None).gen_choices(), ['light red'])
+
+    def test_ignores_artifact_when_source_restored_older(self):
+        filename = self.write_table('colors', '1 alpha')
+        self.set_mtime(filename, 2 * 10**18)
+        artifact = NestedChoices.compile_to_artifact(filename)
+        self.set_mtime(artifact, 3 * 10**18)
+
+        # A different, older version of the file, as a checkout leaves it.
+        self.write_table('colors', '1 beta gamma')
+        self.set_mtime(filename, 10**18)
+        self.assertIsNone(NestedChoices.load_compiled(filename))
+        self.assertEqual(NestedChoices.load_from_file(filename, cache=None).gen_choices(), ['beta gamma'])
+
+    def test_ignores_corrupt_artifact(self):
+        filename = self.write_table('colors', '1 red')
+        with open(table_compiler.artifact_path(filename), 'wb') as f:
+            f.write(b'not a compiled table')
+        self.assertIsNone(NestedChoices.load_compiled(filename))
+        self.assertEqual(NestedChoices.load_from_file(filename, cache=None).gen_choices(), ['red'])
+
+if __name__ == '__main__':
+    unittest.main()
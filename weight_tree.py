@@ -0,0 +1,37 @@
+# A Fenwick (binary indexed) tree over non-negative integer weights, for
+# sampling from a list of weights that only ever go down, such as the choices
+# left in a group once uniqueness starts ruling them out. Removing a choice and
+# picking one are both O(log n).
+class WeightTree():
+
+    def __init__(self, weights):
+        n = len(weights)
+        tree = [0] + list(weights)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.n = n
+        self.tree = tree
+        self.total = sum(weights)
+
+    def subtract(self, index, amount):
+        self.total -= amount
+        i = index + 1
+        while i <= self.n:
+            self.tree[i] -= amount
+            i += i & -i
+
+    # Returns the index of the first weight at which the running total reaches
+    # target, for 1 <= target <= total. This is the same choice that walking the
+    # list and subtracting each weight from target until it hits 0 would make.
+    def find(self, target):
+        position = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.n and self.tree[next_position] < target:
+                position = next_position
+                target -= self.tree[next_position]
+            step >>= 1
+        return position
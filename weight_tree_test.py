@@ -0,0 +1,46 @@
+import random
+import unittest
+
+from weight_tree import WeightTree
+
+# The linear walk WeightTree.find replaces.
+def walk(weights, target):
+    for i, weight in enumerate(weights):
+        target -= weight
+        if target <= 0:
+            return i
+
+class WeightTreeTestCase(unittest.TestCase):
+
+    def assert_matches_walk(self, tree, weights):
+        self.assertEqual(tree.total, sum(weights))
+        for target in range(1, sum(weights) + 1):
+            self.assertEqual(tree.find(target), walk(weights, target))
+
+    def test_find(self):
+        weights = [10, 5, 0, 1, 7]
+        self.assert_matches_walk(WeightTree(weights), weights)
+
+    def test_single(self):
+        self.assert_matches_walk(WeightTree([3]), [3])
+
+    def test_subtract(self):
+        weights = [4, 0, 9, 2, 2, 6, 1]
+        tree = WeightTree(weights)
+        for index in [2, 0, 6, 3]:
+            tree.subtract(index, weights[index])
+            weights[index] = 0
+            self.assert_matches_walk(tree, weights)
+
+    def test_random(self):
+        rng = random.Random(99)
+        for _ in range(20):
+            weights = [rng.randint(0, 20) for _ in range(rng.randint(1, 40))] + [1]
+            tree = WeightTree(weights)
+            for index in rng.sample(range(len(weights) - 1), len(weights) // 2):
+                tree.subtract(index, weights[index])
+                weights[index] = 0
+            self.assert_matches_walk(tree, weights)
+
+if __name__ == '__main__':
+    unittest.main()